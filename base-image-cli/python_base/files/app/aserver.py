@@ -0,0 +1,189 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Async serving mode of the scoring server, started by startServer.sh with server_mode=async.
+# An aiohttp event loop owns the connections and the Flask app of server.py handles the requests:
+# * request bodies are read on the event loop into a spool file before a thread handles the request,
+#   so a slow upload does not hold a thread
+# * files which the Flask app sends, such as the results of /query and the logs, are sent by the event
+#   loop with sendfile from the page cache to the socket, so a slow download does not hold a thread
+# * the requests which score or load a model run in their own thread pool, the other requests, which only
+#   look up jobs and files, in another one, so many downloads do not wait for free threads behind them.
+#   Both pools are threads of the same process: a model scored in the server process holds the GIL
+#   while it computes and slows the event loop down as well, the executions of score scripts and of
+#   partitions run in their own processes
+
+import os
+import sys
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_to_bytes
+
+from aiohttp import web
+from werkzeug.wsgi import FileWrapper
+
+import server
+import upload
+
+FILE_KEY = 'aserver.file'
+
+scoring_threads = int(os.environ.get('server_threads', '8'))
+io_threads = int(os.environ.get('server_io_threads', '16'))
+
+scoring_executor = ThreadPoolExecutor(scoring_threads, thread_name_prefix='score')
+io_executor = ThreadPoolExecutor(io_threads, thread_name_prefix='io')
+
+
+class SentFile(FileWrapper):
+    """
+    wsgi.file_wrapper which lets the event loop send the file instead of iterating over it
+    """
+
+
+# the requests which score or load a model
+def is_scoring(method, path):
+    if method != 'POST':
+        return False
+    if path in ('/executions', '/score', '/admin/model'):
+        return True
+    return path.startswith('/models/') and path.endswith(('/executions', '/score'))
+
+
+# read the request body on the event loop, at most one byte more than the upload limit,
+# which Flask then rejects with 413 as it does without the event loop
+async def spool_body(request):
+    body = tempfile.SpooledTemporaryFile(max_size=upload.CHUNK_SIZE, dir=server.job_root)
+    if not request.body_exists:
+        return body
+    limit = server.max_upload_bytes + 1 if server.max_upload_bytes > 0 else None
+    size = 0
+    while limit is None or size < limit:
+        data = await request.content.read(upload.CHUNK_SIZE if limit is None else min(upload.CHUNK_SIZE, limit - size))
+        if not data:
+            break
+        body.write(data)
+        size += len(data)
+    body.seek(0)
+    return body
+
+
+# the WSGI environ of the request with the spooled body
+def make_environ(request, body):
+    path, _, query = request.raw_path.partition('?')
+    host, _, port = request.host.partition(':')
+    body.seek(0, os.SEEK_END)
+    length = body.tell()
+    body.seek(0)
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': host,
+        'SERVER_PORT': port or ('443' if request.scheme == 'https' else '80'),
+        'SERVER_PROTOCOL': 'HTTP/%d.%d' % request.version,
+        'REMOTE_ADDR': request.remote or '',
+        'CONTENT_TYPE': request.headers.get('Content-Type', ''),
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+            continue
+        environ[key] = environ[key] + ',' + value if key in environ else value
+
+    def file_wrapper(file, buffer_size=8192):
+        wrapper = SentFile(file, buffer_size)
+        environ[FILE_KEY] = wrapper
+        return wrapper
+    environ['wsgi.file_wrapper'] = file_wrapper
+    return environ
+
+
+# call the Flask app in a thread, return the status, the headers and the body
+def call_app(environ):
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+        return lambda data: None
+
+    body = server.app.wsgi_app(environ, start_response)
+    return started[0], started[1], body
+
+
+# the byte range of the file to send: the Content-Range of a partial response or the whole file,
+# the count is None without a Content-Length, which sends the file to its end
+def file_range(wrapper, status, headers):
+    count = int(headers['Content-Length']) if 'Content-Length' in headers else None
+    content_range = headers.get('Content-Range', '')
+    if status == 206 and content_range.startswith('bytes '):
+        return int(content_range[6:].split('-', 1)[0]), count
+    return wrapper.tell(), count
+
+
+async def handle(request):
+    loop = asyncio.get_running_loop()
+    executor = scoring_executor if is_scoring(request.method, request.path) else io_executor
+
+    body = await spool_body(request)
+    try:
+        environ = make_environ(request, body)
+        status, headers, app_iter = await loop.run_in_executor(executor, call_app, environ)
+    finally:
+        body.close()
+
+    code, _, reason = status.partition(' ')
+    response = web.StreamResponse(status=int(code), reason=reason or None)
+    for name, value in headers:
+        response.headers.add(name, value)
+    try:
+        writer = await response.prepare(request)
+        wrapper = environ.get(FILE_KEY)
+        if request.method == 'HEAD':
+            pass
+        elif wrapper is not None and response.status in (200, 206):
+            offset, count = file_range(wrapper, response.status, response.headers)
+            await writer.drain()
+            if count != 0:
+                await loop.sendfile(request.transport, wrapper.file, offset, count)
+        else:
+            # the rows of a converted result are generated in chunks, read them in a thread
+            chunks = iter(app_iter)
+            while True:
+                data = await loop.run_in_executor(io_executor, next, chunks, None)
+                if data is None:
+                    break
+                if data:
+                    await response.write(data)
+        await response.write_eof()
+    finally:
+        if hasattr(app_iter, 'close'):
+            await loop.run_in_executor(io_executor, app_iter.close)
+    return response
+
+
+async def shutdown(app):
+    scoring_executor.shutdown(wait=False)
+    io_executor.shutdown(wait=False)
+
+
+# the application factory for aiohttp.GunicornWebWorker
+async def create_app():
+    # the compressed uploads are decompressed by upload.DecompressMiddleware, which bounds the output
+    app = web.Application(handler_args={'auto_decompress': False})
+    app.router.add_route('*', '/{path:.*}', handle)
+    app.on_cleanup.append(shutdown)
+    server.app.logger.info('Serving on an event loop with ' + str(scoring_threads) + ' scoring threads and '
+                           + str(io_threads) + ' I/O threads')
+    return app
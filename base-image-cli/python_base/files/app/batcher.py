@@ -0,0 +1,114 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Dynamic micro-batching for real-time scoring.
+# Each request is prepared and validated on its own in the thread of its caller, then
+# concurrent requests are queued and collected for up to a wait window or a maximum
+# batch size, scored with one vectorized predict and the results are scattered back
+# to each waiting caller in the same order as their rows.
+
+import time
+import queue
+import threading
+
+import metrics
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+QUEUE_WAIT_BUCKETS = [0.0001, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25]
+
+
+class _Request(object):
+    def __init__(self, data):
+        self.data = data
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """
+    Collect rows from concurrent callers and score them with one predict call.
+    prepare takes the rows of one caller and returns them as data with a length, it raises
+    to that caller alone when the rows are not valid. predict takes a list of the prepared
+    data of several callers and returns a list of the predictions of each of them.
+    With max_wait_ms=0 only the requests which are already queued are batched, so
+    a single caller is never delayed.
+    """
+    def __init__(self, prepare, predict, max_batch_size=64, max_wait_ms=0.0):
+        self.prepare = prepare
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+
+        self.batch_size = metrics.histogram('score_batch_size_rows', 'Rows scored by one predict call of real-time scoring', BATCH_SIZE_BUCKETS)
+        self.batch_requests = metrics.histogram('score_batch_size_requests', 'Requests merged into one predict call of real-time scoring', BATCH_SIZE_BUCKETS)
+        self.queue_wait = metrics.histogram('score_batch_queue_wait_seconds', 'Time a real-time request waited in the batching queue', QUEUE_WAIT_BUCKETS)
+
+        self.thread = threading.Thread(target=self._loop, name='score-batcher', daemon=True)
+        self.thread.start()
+
+    # score the rows with the rows of other concurrent callers, block until done
+    def submit(self, records):
+        request = _Request(self.prepare(records))
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    # stop the batching thread once the queued requests have been scored
+    def close(self):
+        self.queue.put(None)
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        rows = len(first.data)
+        deadline = first.enqueued + self.max_wait
+        while rows < self.max_batch_size:
+            try:
+                remaining = deadline - time.perf_counter()
+                if remaining > 0:
+                    request = self.queue.get(timeout=remaining)
+                else:
+                    request = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)
+                break
+            batch.append(request)
+            rows += len(request.data)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            for request in batch:
+                self.queue_wait.observe(started - request.enqueued)
+            self.batch_size.observe(sum(len(request.data) for request in batch))
+            self.batch_requests.observe(len(batch))
+
+            try:
+                results = self.predict([request.data for request in batch])
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception:
+                # score the requests one by one so that a bad row only fails its own caller
+                for request in batch:
+                    try:
+                        request.result = self.predict([request.data])[0]
+                    except Exception as e:
+                        request.error = e
+            for request in batch:
+                request.done.set()
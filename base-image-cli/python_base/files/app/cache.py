@@ -0,0 +1,123 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Content-addressed result cache for batch executions.
+# A job is keyed by the sha256 of its input together with the digest of the model zip and
+# the score script, so resubmitting the same input to the same model image returns the
+# job which has scored it already, or is still scoring it, instead of running it again.
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+import jobs
+
+BLOCK_SIZE = 1 << 20
+
+
+# sha256 of the content of the files in order
+def digest_files(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(BLOCK_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+    return digest.hexdigest()
+
+
+# the cache key of scoring an input with the model into the output format
+def cache_key(input_digest, model_digest, output_format):
+    return hashlib.sha256((input_digest + ':' + model_digest + ':' + output_format).encode('ascii')).hexdigest()
+
+
+class _Entry(object):
+    def __init__(self, job):
+        self.job = job
+        self.created = time.time()
+        self.size = 0
+
+
+class ResultCache(object):
+    """
+    Map cache keys to the jobs which produced the results.
+    Failed jobs are never returned, entries older than ttl seconds are dropped and
+    the least recently used entries are dropped when the results exceed max_bytes.
+    Dropping an entry only forgets the job, the workspace stays for /query.
+    """
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = metrics.counter('result_cache_hits_total', 'Executions answered with the result of an identical job')
+        self.misses = metrics.counter('result_cache_misses_total', 'Executions which had to be scored')
+        self.evictions = metrics.counter('result_cache_evictions_total', 'Jobs dropped from the result cache by age or size')
+        self.size = metrics.gauge('result_cache_bytes', 'Size of the results kept in the result cache')
+
+    # return the queued, running or done job of the key, or None
+    def get(self, key, result_exists):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                job = entry.job
+                expired = time.time() - entry.created > self.ttl
+                if expired or job.state in (jobs.FAILED, jobs.CANCELLED) or (job.state == jobs.DONE and not result_exists(job)):
+                    self._remove(key)
+                    entry = None
+                else:
+                    self.entries.move_to_end(key)
+        if entry is None:
+            self.misses.inc()
+            return None
+        self.hits.inc()
+        return entry.job
+
+    def put(self, key, job):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = _Entry(job)
+
+    # forget the job of the key, when the job is not run after all or has failed,
+    # only if the key still maps to job when it is given
+    def discard(self, key, job=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (job is None or entry.job is job):
+                self._remove(key)
+
+    # record the size of the result when the job is done and evict to stay within max_bytes
+    def complete(self, key, size):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry.size = size
+            self.total_bytes += size
+            now = time.time()
+            # the least recently used entries come first
+            for old_key in list(self.entries.keys()):
+                old = self.entries[old_key]
+                expired = now - old.created > self.ttl
+                if expired or (self.total_bytes > self.max_bytes and old.size > 0 and old_key != key):
+                    self._remove(old_key)
+                    self.evictions.inc()
+            if key in self.entries and self.total_bytes > self.max_bytes:
+                # the result alone is larger than the cache
+                self._remove(key)
+                self.evictions.inc()
+            self.size.set(self.total_bytes)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size
+        self.size.set(self.total_bytes)
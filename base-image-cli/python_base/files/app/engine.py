@@ -0,0 +1,164 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# In-process scoring engine.
+# The default score script _score.py and the pickle model are loaded once when the
+# server starts, so each execution only pays for reading, predicting and writing
+# instead of a new interpreter, the imports and unpickling the model again.
+
+import os
+import sys
+import threading
+import importlib.util
+from contextlib import contextmanager
+
+import tracing
+
+DEFAULT_SCORE_SCRIPT = '_score.py'
+
+
+# import the score script from the model directory as a module
+def load_score_module(model_dir, score_file=DEFAULT_SCORE_SCRIPT):
+    script = os.path.join(model_dir, score_file)
+    name = os.path.splitext(score_file)[0]
+    spec = importlib.util.spec_from_file_location(name, script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class MissingColumns(Exception):
+    """
+    Rows of a real-time request without an input column of the model, the message is returned to the client
+    """
+
+
+class ThreadLocalStream(object):
+    """
+    Replacement of sys.stdout and sys.stderr which writes into the file set by the current thread,
+    so that concurrent in-process jobs each write the output of the score script into their own log
+    """
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _target(self):
+        target = getattr(self.local, 'target', None)
+        if target is None:
+            return self.default
+        return target
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+def install_output_capture():
+    if not isinstance(sys.stdout, ThreadLocalStream):
+        sys.stdout = ThreadLocalStream(sys.stdout)
+    if not isinstance(sys.stderr, ThreadLocalStream):
+        sys.stderr = ThreadLocalStream(sys.stderr)
+
+
+# redirect stdout and stderr of the current thread into the file
+@contextmanager
+def capture_output(f):
+    install_output_capture()
+    streams = [sys.stdout, sys.stderr]
+    previous = [getattr(stream.local, 'target', None) for stream in streams]
+    for stream in streams:
+        stream.local.target = f
+    try:
+        yield f
+    finally:
+        for stream, target in zip(streams, previous):
+            stream.local.target = target
+
+
+class WarmModel(object):
+    """
+    The model and the default score script loaded once.
+    memo is an optional memo.PredictionMemo which is asked before the model predicts.
+    input_vars and output_vars are the variables of the score plan, they are read by the
+    score script from inputVar.json and outputVar.json when they are not given.
+    """
+    def __init__(self, model_dir, model_file, memo=None, input_vars=None, output_vars=None):
+        self.model_dir = model_dir
+        self.memo = memo
+        self.model_file = os.path.join(model_dir, model_file)
+        self.module = load_score_module(model_dir)
+
+        # resolve variable lists once instead of on every execution
+        self.input_vars = input_vars if input_vars is not None else self.module.load_var_names('inputVar.json')
+        self.output_vars = output_vars if output_vars is not None else self.module.load_var_names('outputVar.json')
+        with tracing.phase('load'):
+            self.model = self.module.load_model(self.model_file)
+
+    # score input csv file and write the result into output csv file
+    # the same steps as score_file of the score script, each phase is timed
+    def score_file(self, input_file, output_file):
+        if not os.path.isfile(input_file):
+            raise RuntimeError('Not found input file ' + input_file)
+        with tracing.phase('read'):
+            inputDf = self.module.read_data(input_file).fillna(0)
+
+        outputDf = self.module.score_data(self.model, inputDf, self.input_vars, self.output_vars, self.predict)
+
+        print('printing first few lines...')
+        print(outputDf.head())
+        with tracing.phase('write'):
+            self.module.write_data(outputDf, output_file)
+        return outputDf
+
+    # the input columns which each row of a real-time request must have: the feature names the
+    # model was fitted with, otherwise the input variables
+    def required_columns(self):
+        feature_names = getattr(self.model, 'feature_names_in_', None)
+        if feature_names is not None:
+            return list(feature_names)
+        return list(self.input_vars) if self.input_vars is not None else []
+
+    # the frame of the rows of one real-time request given as dicts, in the columns selected by the
+    # same rule as the columns of a batch execution, a missing input column raises MissingColumns
+    # instead of being scored as 0
+    def prepare_records(self, records):
+        missing = [name for name in self.required_columns() if any(name not in row for row in records)]
+        if missing:
+            raise MissingColumns('Missing input columns: ' + ', '.join(missing))
+        data = self.module.pd.DataFrame.from_records(records)
+        return self.module.select_input_vars(data, self.input_vars, self.model).fillna(0)
+
+    # score the frames of several requests and return the probabilities of the rows of each frame,
+    # the frames with the same columns are scored together with one predict call
+    def predict_frames(self, frames):
+        groups = {}
+        for index, frame in enumerate(frames):
+            groups.setdefault(tuple(frame.columns), []).append(index)
+        results = [None] * len(frames)
+        for indexes in groups.values():
+            group = [frames[index] for index in indexes]
+            data = group[0] if len(group) == 1 else self.module.pd.concat(group, ignore_index=True)
+            predictions = self.predict(self.model, data, self.output_vars).to_dict('records')
+            offset = 0
+            for index in indexes:
+                results[index] = predictions[offset:offset + len(frames[index])]
+                offset += len(frames[index])
+        return results
+
+    # score a list of rows given as dicts and return the probabilities for each row
+    def score_records(self, records):
+        return self.predict_frames([self.prepare_records(records)])[0]
+
+    # predict_data of the score script, through the prediction memo if there is one
+    def predict(self, pkl_model, in_dataf, output_vars):
+        with tracing.phase('predict'):
+            if self.memo is None:
+                return self.module.predict_data(pkl_model, in_dataf, output_vars)
+            return self.memo.predict(in_dataf, lambda data: self.module.predict_data(pkl_model, data, output_vars))
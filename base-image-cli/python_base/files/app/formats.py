@@ -0,0 +1,153 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Input and output formats of batch scoring.
+# Besides csv, the inputs and results can be Parquet or Arrow IPC files. The format is chosen
+# by the file extension or the content type of the upload. The default score script reads and
+# writes all formats, custom score scripts get csv files which are converted here.
+
+import io
+import os
+
+EXTENSIONS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+
+CONTENT_TYPES = {
+    'application/vnd.apache.parquet': 'parquet',
+    'application/parquet': 'parquet',
+    'application/x-parquet': 'parquet',
+    'application/vnd.apache.arrow.file': 'arrow',
+}
+
+
+# the format of the file by its extension, csv if it is not known
+def format_of(file_name):
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext in ('.parquet', '.pq'):
+        return 'parquet'
+    if ext in ('.arrow', '.feather', '.ipc'):
+        return 'arrow'
+    return 'csv'
+
+
+# the format of an upload by its content type, or None
+def format_of_mimetype(mimetype):
+    return CONTENT_TYPES.get(mimetype)
+
+
+# return the column names of the data file
+def read_columns(path):
+    fmt = format_of(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    if fmt == 'arrow':
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema.names
+
+    import pandas as pd
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+# return the number of rows of the data file, without parsing a csv file
+# quoted line breaks inside csv values are counted as rows
+def count_rows(path):
+    fmt = format_of(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    if fmt == 'arrow':
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            lines += data.count(b'\n')
+            last = data[-1:]
+    if last != b'\n':
+        lines += 1
+    # without the header
+    return max(0, lines - 1)
+
+
+# move the binary file past the given number of lines without parsing them,
+# quoted line breaks inside csv values are counted as lines as in count_rows
+def skip_lines(f, count):
+    while count > 0:
+        start = f.tell()
+        data = f.read(1 << 20)
+        if not data:
+            return
+        lines = data.count(b'\n')
+        if lines < count:
+            count -= lines
+            continue
+        end = -1
+        for _ in range(count):
+            end = data.index(b'\n', end + 1)
+        f.seek(start + end + 1)
+        return
+
+
+# read the data file into a data frame, only the given columns are read
+def read_frame(path, columns=None):
+    import pandas as pd
+
+    fmt = format_of(path)
+    if fmt == 'parquet':
+        return pd.read_parquet(path, columns=columns).reset_index(drop=True)
+    if fmt == 'arrow':
+        return pd.read_feather(path, columns=columns)
+
+    df = pd.read_csv(path, usecols=columns)
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+# write the data frame in the format into the file or buffer
+def write_frame(df, dest, fmt):
+    if fmt == 'parquet':
+        df.to_parquet(dest, index=False)
+    elif fmt == 'arrow':
+        df.reset_index(drop=True).to_feather(dest)
+    else:
+        df.to_csv(dest, index=False)
+
+
+# return the data frame in the format as bytes
+def to_bytes(df, fmt):
+    if fmt == 'jsonl':
+        text = df.to_json(orient='records', lines=True, double_precision=15)
+        if text and not text.endswith('\n'):
+            text += '\n'
+        return text.encode('utf-8')
+
+    buffer = io.BytesIO()
+    write_frame(df, buffer, fmt)
+    return buffer.getvalue()
+
+
+# convert the data file into the format of the destination file extension
+def convert(src, dest):
+    write_frame(read_frame(src), dest, format_of(dest))
@@ -0,0 +1,427 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Asynchronous score executions.
+# /executions hands each job to a bounded pool of worker threads and returns at once,
+# the state and the timings of the job are kept here for /jobs/<id>.
+# The number of jobs waiting for a worker can be bounded, the executions beyond it are rejected.
+# A job is cancelled by killing the score processes it has started, see Job.attach.
+# The job store indexes the jobs and their workspaces in memory and removes the workspaces
+# when the jobs expire or the workspaces exceed the disk quota, oldest first.
+
+import os
+import re
+import math
+import time
+import uuid
+import threading
+import shutil
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# the job run by the current worker thread
+_local = threading.local()
+
+
+class JobError(Exception):
+    """
+    Failure of a job, the message is returned to the client as the error of the job
+    """
+
+
+# collision-free id of a job, also the name of its workspace
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+# each job gets its own directory for the input, result and log files
+def create_workspace(root, job_id):
+    workspace = os.path.join(root, job_id)
+    os.makedirs(workspace)
+    return workspace
+
+
+# the job which the current thread is running, or None
+def current_job():
+    return getattr(_local, 'job', None)
+
+
+# remove the files of the workspace except the log of the job
+def remove_partial_output(job):
+    for name in os.listdir(job.workspace):
+        if name == job.id + '.log':
+            continue
+        path = os.path.join(job.workspace, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# return the workspace of the job id, or None if it is not a valid job id
+def get_workspace(root, job_id):
+    if not JOB_ID_PATTERN.match(job_id):
+        return None
+    return os.path.join(root, job_id)
+
+
+class Job(object):
+    def __init__(self, job_id, input_file, workspace, output_format='csv', ttl=None):
+        self.id = job_id
+        self.input_file = input_file
+        self.workspace = workspace
+        self.output_format = output_format
+        self.ttl = ttl
+        self.cache_key = None
+        self.profile = False
+        self.trace = None
+        # the models.ModelVersion which scores the job
+        self.model = None
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # the last time the result was handed out again by the result cache
+        self.touched = None
+        self.error = None
+        self.size = 0
+        self.done = threading.Event()
+        self.done_callbacks = []
+        self.cancel_requested = False
+        self.processes = []
+        self.lock = threading.Lock()
+
+    def is_finished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    # track a score process of the running job, it is killed when the job is cancelled
+    def attach(self, process):
+        with self.lock:
+            self.processes.append(process)
+            cancelled = self.cancel_requested
+        if cancelled:
+            process.kill()
+
+    # kill the score processes of the job, the worker thread marks it as cancelled
+    def cancel(self):
+        with self.lock:
+            self.cancel_requested = True
+            processes = list(self.processes)
+        for process in processes:
+            process.kill()
+
+    # the time when the workspace of the job is removed, None while the job is not finished
+    # the ttl counts from the last time the result cache handed out the job
+    def expires(self):
+        if not self.is_finished() or self.ttl is None:
+            return None
+        return max(self.finished, self.touched or 0) + self.ttl
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    # call fn(job) once when the job has finished, whether it is done, failed or cancelled
+    def add_done_callback(self, fn):
+        self.done_callbacks.append(fn)
+
+    def set_done(self):
+        self.done.set()
+        for fn in self.done_callbacks:
+            try:
+                fn(self)
+            except Exception:
+                traceback.print_exc()
+
+    def to_dict(self):
+        result = {
+            'id': self.id,
+            'state': self.state,
+            'format': self.output_format,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if self.started is not None:
+            result['queue_seconds'] = self.started - self.submitted
+        if self.finished is not None and self.started is not None:
+            result['run_seconds'] = self.finished - self.started
+        if self.is_finished():
+            result['bytes'] = self.size
+            result['expires'] = self.expires()
+        if self.profile:
+            result['profile'] = True
+        if self.model is not None and self.model.model_id is not None:
+            result['model_id'] = self.model.model_id
+        elif self.model is not None:
+            result['model_version'] = self.model.name
+        if self.trace is not None:
+            result['trace_id'] = self.trace.trace_id
+            result['spans'] = self.trace.to_list()
+        if self.error is not None:
+            result['error'] = self.error
+        return result
+
+
+# total size of the files in the directory
+def directory_size(directory):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return size
+
+
+class JobStore(object):
+    """
+    In-memory index of the jobs in the order of submission.
+    A finished job keeps its workspace for ttl seconds, unless the job has its own ttl.
+    When the workspaces of the finished jobs exceed max_bytes the oldest ones are removed,
+    max_bytes 0 means no quota. Queued and running jobs are never removed.
+    """
+    def __init__(self, root, ttl, max_bytes=0):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.jobs = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.count = metrics.gauge('job_store_jobs', 'Jobs in the job store')
+        self.size = metrics.gauge('job_store_bytes', 'Disk space of the finished jobs in the job store')
+        self.evictions = metrics.counter('job_store_evictions_total', 'Jobs removed from the job store by ttl or disk quota')
+
+    def add(self, job):
+        if job.ttl is None:
+            job.ttl = self.ttl
+        with self.lock:
+            self.jobs[job.id] = job
+            self.count.set(len(self.jobs))
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    # the result of the job is used again: restart its ttl and move it behind the other jobs,
+    # which are removed before it when the quota is exceeded
+    def touch(self, job):
+        job.touched = time.time()
+        with self.lock:
+            if job.id in self.jobs:
+                self.jobs.move_to_end(job.id)
+
+    # return the jobs in the order of submission, optionally only the jobs in the state
+    def list(self, state=None):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        if state is not None:
+            jobs = [job for job in jobs if job.state == state]
+        return jobs
+
+    # record the disk space of the finished job and enforce the quota
+    # the job itself is kept, so that its result can be fetched at least once
+    def completed(self, job):
+        job.size = directory_size(job.workspace)
+        with self.lock:
+            if job.id in self.jobs:
+                self.total_bytes += job.size
+                self.size.set(self.total_bytes)
+        self.evict(keep=job)
+
+    # remove the expired jobs and the oldest finished jobs beyond the quota
+    def evict(self, keep=None):
+        now = time.time()
+        removed = []
+        with self.lock:
+            for job in list(self.jobs.values()):
+                if not job.is_finished() or job is keep:
+                    continue
+                expires = job.expires()
+                over_quota = self.max_bytes > 0 and self.total_bytes > self.max_bytes
+                if (expires is not None and expires <= now) or over_quota:
+                    self._remove(job)
+                    removed.append(job)
+        for job in removed:
+            shutil.rmtree(job.workspace, ignore_errors=True)
+            self.evictions.inc()
+        return removed
+
+    def _remove(self, job):
+        del self.jobs[job.id]
+        self.total_bytes -= job.size
+        self.count.set(len(self.jobs))
+        self.size.set(self.total_bytes)
+
+    # rebuild the index from the workspaces under the root after a restart
+    # result_file(workspace, job_id) returns the result file of a job or None
+    def rebuild(self, result_file):
+        workspaces = []
+        for name in os.listdir(self.root):
+            workspace = os.path.join(self.root, name)
+            if JOB_ID_PATTERN.match(name) and os.path.isdir(workspace):
+                workspaces.append((os.path.getmtime(workspace), name, workspace))
+
+        for mtime, job_id, workspace in sorted(workspaces):
+            job = Job(job_id, None, workspace)
+            job.submitted = mtime
+            job.started = mtime
+            job.finished = mtime
+            if result_file(workspace, job_id) is not None:
+                job.state = DONE
+            else:
+                # the server stopped before the job was done
+                job.state = FAILED
+                job.error = 'The job did not complete before the server restarted'
+            job.done.set()
+            self.add(job)
+            job.size = directory_size(workspace)
+            with self.lock:
+                self.total_bytes += job.size
+                self.size.set(self.total_bytes)
+        return len(workspaces)
+
+
+# remove the expired jobs every interval seconds in a background thread
+def start_janitor(store, interval):
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                store.evict()
+            except Exception:
+                traceback.print_exc()
+
+    thread = threading.Thread(target=loop, name='job-janitor', daemon=True)
+    thread.start()
+    return thread
+
+
+class JobQueue(object):
+    """
+    Run score jobs in a bounded pool of worker threads, the jobs are kept in the job store.
+    run takes a job and returns True if the job succeeded.
+    At most max_queued jobs wait for a worker, 0 means no limit.
+    """
+    def __init__(self, run, store, max_workers=1, max_queued=0):
+        self.run = run
+        self.store = store
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.queued = 0
+        self.average_seconds = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='score-job')
+
+        self.depth = metrics.gauge('job_queue_depth', 'Jobs waiting for a score worker')
+        self.running = metrics.gauge('job_queue_running', 'Jobs being scored by a score worker')
+        self.rejected = metrics.counter('job_queue_rejected_total', 'Executions rejected because the job queue was full')
+
+    def is_full(self):
+        return self.max_queued > 0 and self.queued >= self.max_queued
+
+    # check the queue before the upload of an execution is read, count it as rejected if the queue is full
+    def accepts(self):
+        if self.is_full():
+            self.rejected.inc()
+            return False
+        return True
+
+    # queue the job, return None if the queue is full
+    def submit(self, job):
+        with self.lock:
+            if self.is_full():
+                self.rejected.inc()
+                return None
+            self.queued += 1
+            self.depth.set(self.queued)
+        self.store.add(job)
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    # cancel a queued or running job, return False if the job has finished already
+    # a queued job is cancelled at once, a running job when its score processes have been killed
+    def cancel(self, job):
+        with self.lock:
+            if job.is_finished():
+                return False
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                self.queued -= 1
+                self.depth.set(self.queued)
+            else:
+                job.cancel()
+                return True
+        job.error = 'The job was cancelled'
+        job.finished = time.time()
+        remove_partial_output(job)
+        self.store.completed(job)
+        job.set_done()
+        return True
+
+    # estimate the seconds until a worker takes the next queued job
+    def retry_after(self):
+        seconds = self.average_seconds if self.average_seconds is not None else 1.0
+        return min(3600, max(1, int(math.ceil(seconds / self.max_workers))))
+
+    def _run(self, job):
+        with self.lock:
+            if job.state == CANCELLED:
+                return
+            self.queued -= 1
+            self.depth.set(self.queued)
+            job.started = time.time()
+            job.state = RUNNING
+        self.running.inc()
+        _local.job = job
+        try:
+            if not job.cancel_requested and self.run(job):
+                job.state = DONE
+            else:
+                job.state = FAILED
+                job.error = 'The score script did not produce any result, please check the execution log'
+        except JobError as e:
+            job.state = FAILED
+            job.error = str(e)
+        except Exception:
+            job.state = FAILED
+            job.error = traceback.format_exc()
+        finally:
+            _local.job = None
+            self.running.inc(-1)
+            job.finished = time.time()
+            if job.cancel_requested:
+                # the score processes have been killed, whatever they have written is dropped
+                job.state = CANCELLED
+                job.error = 'The job was cancelled'
+                remove_partial_output(job)
+            else:
+                # moving average of the run time
+                seconds = job.finished - job.started
+                with self.lock:
+                    if self.average_seconds is None:
+                        self.average_seconds = seconds
+                    else:
+                        self.average_seconds = 0.8 * self.average_seconds + 0.2 * seconds
+            self.store.completed(job)
+            job.set_done()
@@ -0,0 +1,62 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Resource limits of the score processes.
+# Every score process runs in its own process group with an optional address space limit,
+# and the whole group is killed when it exceeds the wall-clock timeout, so that a runaway
+# score script fails its job instead of taking the pod down.
+
+import os
+import time
+import signal
+import resource
+import subprocess
+
+
+# return the preexec_fn of subprocess.Popen which limits the address space of the child before it
+# runs the score script, the allocations beyond it fail with MemoryError; None without a limit
+def memory_limiter(limit):
+    if limit <= 0:
+        return None
+
+    def set_memory_limit():
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return set_memory_limit
+
+
+# kill the score process and everything it has started
+def kill_process_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class LimitedProcess(object):
+    """
+    Score process with a wall-clock timeout, like subprocess.Popen
+    process is a subprocess.Popen or a zygote.ZygoteProcess which leads its own process group
+    """
+    def __init__(self, process, timeout=0):
+        self.process = process
+        self.pid = process.pid
+        self.timeout = timeout
+        self.deadline = None
+        if timeout > 0:
+            self.deadline = time.monotonic() + timeout
+        self.timed_out = False
+
+    def wait(self):
+        if self.deadline is None:
+            return self.process.wait()
+        try:
+            return self.process.wait(max(0.0, self.deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            self.timed_out = True
+            kill_process_group(self.pid)
+            return self.process.wait()
+
+    def kill(self):
+        kill_process_group(self.pid)
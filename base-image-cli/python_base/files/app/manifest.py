@@ -0,0 +1,162 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Score plan of the model in the container.
+# The model image CLI inspects the model zip file when it publishes the image and writes manifest.json
+# next to the zip file: the resolved score script, the model file, the input and output variables and
+# the sha256 digests of the zip file and of its files. The server loads the manifest once at startup and
+# keeps the plan in memory, so no request lists the model directory or parses fileMetadata.json again.
+# Images without a manifest get the same plan from the extracted model directory, also once at startup.
+#
+# The rules are the same as in ManifestLib.py of the model image CLI:
+#   1) ContainerWrapper.py (ContainerWrapper.R)
+#   2) the score code of fileMetadata.json
+#   3) the first other script ending with score.py (score.R)
+#   4) the default score script of the base image _score.py (_score.R)
+
+import os
+import json
+import hashlib
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+BLOCK_SIZE = 1024 * 1024
+
+EXTENSIONS = {'python': '.py', 'r': '.R'}
+
+
+def digest_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(BLOCK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+# the first name which ends with the suffix
+def find_name(names, suffix):
+    for name in names:
+        if name.endswith(suffix):
+            return name
+    return None
+
+
+# the names of the files with the role in fileMetadata.json
+def names_by_role(rows, role):
+    if rows is None:
+        return None
+    names = [row['name'] for row in rows if row.get('role') == role]
+    if names == []:
+        return None
+    return names
+
+
+# resolve the score script, the model file and the variables from the top level files of the model,
+# read_json(name) returns the parsed json file of the model
+def resolve(names, read_json, language='python'):
+    names = sorted(names)
+    extension = EXTENSIONS[language]
+    default_score_script = '_score' + extension
+
+    metadata_file = find_name(names, 'fileMetadata.json')
+    metadata = read_json(metadata_file) if metadata_file is not None else None
+
+    if 'ContainerWrapper' + extension in names:
+        score_script = 'ContainerWrapper' + extension
+    elif names_by_role(metadata, 'score') is not None:
+        score_script = names_by_role(metadata, 'score')[0]
+    else:
+        score_script = find_name([n for n in names if n != default_score_script], 'score' + extension)
+        if score_script is None:
+            score_script = default_score_script
+
+    models = names_by_role(metadata, 'model')
+    input_file = find_name(names, 'inputVar.json')
+    output_file = find_name(names, 'outputVar.json')
+    return {
+        'language': language,
+        'score_script': score_script,
+        'model_file': models[0] if models is not None else None,
+        'pickle_file': find_name(names, '.pkl') if language == 'python' else None,
+        'input_variables': read_json(input_file) if input_file is not None else None,
+        'output_variables': read_json(output_file) if output_file is not None else None,
+    }
+
+
+class ScorePlan(object):
+    """
+    How to score the model, resolved once at startup from manifest.json or from the model directory.
+    score_script and model_file are relative to model_dir, model_file is None unless fileMetadata.json
+    names it, and pickle_file is the first pickle file of a python model.
+    """
+    def __init__(self, model_dir, zip_file, plan, digests=None, source=MANIFEST_FILE):
+        self.model_dir = model_dir
+        self.zip_file = zip_file
+        self.language = plan['language']
+        self.score_script = plan['score_script']
+        self.model_file = plan['model_file']
+        self.pickle_file = plan['pickle_file']
+        self.input_variables = plan['input_variables']
+        self.output_variables = plan['output_variables']
+        self.digests = digests or {}
+        self.source = source
+
+    def input_names(self):
+        if self.input_variables is None:
+            return None
+        return [row['name'] for row in self.input_variables]
+
+    def output_names(self):
+        if self.output_variables is None:
+            return None
+        return [row['name'] for row in self.output_variables]
+
+    # the identity of the model for the result cache: the zip file and the score script,
+    # the default score script is a file of the base image and not in the manifest
+    def model_digest(self):
+        zip_digest = self.digests.get(self.zip_file) or digest_file(os.path.join(self.model_dir, self.zip_file))
+        script_digest = self.digests.get(self.score_script)
+        script_path = os.path.join(self.model_dir, self.score_script)
+        if script_digest is None and os.path.isfile(script_path):
+            script_digest = digest_file(script_path)
+        return hashlib.sha256((zip_digest + ':' + (script_digest or '')).encode('ascii')).hexdigest()
+
+
+# the parsed manifest.json of the model directory, or None if the image has been built without it
+def load(model_dir):
+    path = os.path.join(model_dir, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('manifest_version') != MANIFEST_VERSION:
+        raise RuntimeError('Unsupported ' + MANIFEST_FILE + ' version ' + str(manifest.get('manifest_version')))
+    return manifest
+
+
+# whether the files of the zip file are in the model directory already, extracted when the image was built
+def is_extracted(model_dir, manifest):
+    names = [name for name in manifest.get('digests', {}) if name != manifest['zip_file']]
+    if not names:
+        return False
+    return all(os.path.isfile(os.path.join(model_dir, name)) for name in names)
+
+
+def from_manifest(model_dir, manifest):
+    return ScorePlan(model_dir, manifest['zip_file'], manifest['plan'], manifest.get('digests'))
+
+
+# the plan of a model directory which has been extracted without a manifest
+def discover(model_dir, zip_file, language='python'):
+    def read_json(name):
+        with open(os.path.join(model_dir, name)) as f:
+            return json.load(f)
+
+    names = [name for name in os.listdir(model_dir) if os.path.isfile(os.path.join(model_dir, name))]
+    return ScorePlan(model_dir, zip_file, resolve(names, read_json, language), source=model_dir)
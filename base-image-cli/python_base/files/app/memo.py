@@ -0,0 +1,109 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Row-level prediction memoization for the model loaded in the server process.
+# Each row is keyed by a 128 bit hash of the model input columns. Duplicate rows of a
+# batch are predicted once and the predictions are scattered back to every row, and
+# the predictions are kept in a memory-bounded LRU across executions and requests.
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# two independent 64 bit hashes of each row
+HASH_KEYS = ('0123456789123456', 'memo-prediction1')
+
+# bookkeeping of an OrderedDict entry besides the key and the values
+ENTRY_OVERHEAD = 160
+
+
+# return the 16 byte keys of the rows
+def row_keys(in_dataf):
+    hashes = [pd.util.hash_pandas_object(in_dataf, index=False, hash_key=key).values for key in HASH_KEYS]
+    return np.ascontiguousarray(np.stack(hashes, axis=1)).view('V16').ravel()
+
+
+class PredictionMemo(object):
+    """
+    Memoize the predictions of the rows, predict takes a data frame of the model input
+    columns and returns a data frame of the predictions with one row for each input row.
+    The rows must not contain missing values, the imputation depends on the whole batch.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.columns = None
+        self.lock = threading.Lock()
+
+        self.hits = metrics.counter('prediction_memo_hits_total', 'Rows whose predictions were found in the prediction memo')
+        self.misses = metrics.counter('prediction_memo_misses_total', 'Rows which had to be predicted')
+        self.duplicates = metrics.counter('prediction_memo_batch_duplicates_total', 'Rows which repeat another row of the same batch')
+        self.hit_ratio = metrics.gauge('prediction_memo_hit_ratio', 'Share of the rows answered by the prediction memo')
+        self.size = metrics.gauge('prediction_memo_bytes', 'Estimated memory of the prediction memo')
+        self.count = metrics.gauge('prediction_memo_entries', 'Rows kept in the prediction memo')
+
+    def predict(self, in_dataf, predict):
+        if len(in_dataf) == 0 or in_dataf.isnull().values.any():
+            return predict(in_dataf)
+
+        keys = row_keys(in_dataf)
+        unique_keys, first_rows, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        unique_keys = unique_keys.tolist()
+        self.duplicates.inc(len(keys) - len(unique_keys))
+
+        cached = {}
+        with self.lock:
+            for i, key in enumerate(unique_keys):
+                values = self.entries.get(key)
+                if values is not None:
+                    self.entries.move_to_end(key)
+                    cached[i] = values
+        missing = [i for i in range(len(unique_keys)) if i not in cached]
+
+        predicted = None
+        if missing:
+            predicted = predict(in_dataf.iloc[first_rows[missing]].reset_index(drop=True))
+            columns = list(predicted.columns)
+        else:
+            columns = self.columns
+
+        values = np.empty((len(unique_keys), len(columns)))
+        for i, row in cached.items():
+            values[i] = row
+        if predicted is not None:
+            predicted_values = predicted.values.astype(float)
+            values[missing] = predicted_values
+            self._store([unique_keys[i] for i in missing], predicted_values, columns)
+
+        self.hits.inc(len(cached))
+        self.misses.inc(len(missing))
+        total = self.hits.value + self.misses.value
+        if total > 0:
+            self.hit_ratio.set(float(self.hits.value) / total)
+
+        return pd.DataFrame(values[inverse.ravel()], columns=columns)
+
+    def _store(self, keys, rows, columns):
+        entry_bytes = 16 + rows.shape[1] * 8 + ENTRY_OVERHEAD
+        with self.lock:
+            if self.columns != columns:
+                # another output layout, the old predictions do not fit any more
+                self.entries.clear()
+                self.total_bytes = 0
+                self.columns = columns
+            for key, row in zip(keys, rows):
+                if key not in self.entries:
+                    self.total_bytes += entry_bytes
+                self.entries[key] = row.copy()
+            while self.total_bytes > self.max_bytes and self.entries:
+                self.entries.popitem(last=False)
+                self.total_bytes -= entry_bytes
+            self.size.set(self.total_bytes)
+            self.count.set(len(self.entries))
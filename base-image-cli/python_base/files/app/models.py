@@ -0,0 +1,338 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Versions of the model in the scoring server.
+# The model of the image is the first version. A new model zip file posted to the admin endpoint is
+# extracted into its own directory, loaded and warmed up in the background while the current version
+# keeps scoring, then it becomes the current version in one step.
+# Executions and real-time requests hold the version they started with, so the work in flight finishes
+# on the old model. The previous version stays loaded for a rollback, older versions are unloaded and
+# their directories removed as soon as no execution uses them any more.
+#
+# In the multi-model mode the server scores many models of a model store, a mounted directory or an
+# artifact store, by the model id in the path. The models are loaded on first use into a least recently
+# used cache, which is bounded by the size of the extracted model files.
+
+import re
+import time
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+
+import metrics
+
+MODEL_ID_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$')
+
+LOAD_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+IMAGE_VERSION = 'image'
+
+LOADING = 'loading'
+WARMING = 'warming'
+CURRENT = 'current'
+PREVIOUS = 'previous'
+RETIRED = 'retired'
+FAILED = 'failed'
+
+
+class ModelNotFound(Exception):
+    """
+    The model id is not in the model store
+    """
+
+
+# a new version name, sortable by the time of the upload, unique even for the same zip file
+# uploaded twice within a second
+def new_version_name(digest):
+    return time.strftime('%Y%m%d%H%M%S', time.gmtime()) + '-' + digest[:8] + '-' + uuid.uuid4().hex[:8]
+
+
+# model ids are file names in the model store
+def is_model_id(model_id):
+    return MODEL_ID_PATTERN.match(model_id) is not None
+
+
+class ModelVersion(object):
+    """
+    One version of the model: the directory of the extracted zip file, the score plan and, when
+    the model is scored in the server process, the warm model and the micro batcher.
+    digest identifies the version in the result cache. users counts the executions and
+    real-time requests which are scored by this version. model_id is the id of a model of the
+    model store, size the disk space of its extracted files.
+    """
+    def __init__(self, name, model_dir, zip_file, removable=True, model_id=None):
+        self.name = name
+        self.model_id = model_id
+        self.model_dir = model_dir
+        self.zip_file = zip_file
+        self.removable = removable
+        self.plan = None
+        self.warm_model = None
+        self.batcher = None
+        self.digest = None
+        self.state = LOADING
+        self.created = time.time()
+        self.activated = None
+        self.load_seconds = None
+        self.error = None
+        self.users = 0
+        self.size = 0
+        self.done = threading.Event()
+
+    def loaded(self, plan, warm_model=None, batcher=None, digest=None):
+        self.plan = plan
+        self.warm_model = warm_model
+        self.batcher = batcher
+        self.digest = digest
+
+    # stop the micro batcher, drop the model and remove the extracted files
+    def unload(self):
+        if self.batcher is not None:
+            self.batcher.close()
+        self.batcher = None
+        self.warm_model = None
+        if self.removable:
+            shutil.rmtree(self.model_dir, ignore_errors=True)
+
+    def to_dict(self):
+        result = {
+            'version': self.name,
+            'state': self.state,
+            'zip_file': self.zip_file,
+            'created': self.created,
+            'activated': self.activated,
+            'load_seconds': self.load_seconds,
+        }
+        if self.plan is not None:
+            result['score_script'] = self.plan.score_script
+            result['in_process'] = self.warm_model is not None
+        if self.digest is not None:
+            result['digest'] = self.digest
+        if self.model_id is not None:
+            result['model_id'] = self.model_id
+            result['bytes'] = self.size
+            result['users'] = self.users
+        if self.error is not None:
+            result['error'] = self.error
+        return result
+
+
+class ModelRegistry(object):
+    """
+    The current, the previous and the pending version of the model.
+    acquire returns the current version for an execution or a real-time request, which gives it back
+    by release when it is done. Only one new version is loaded at a time.
+    """
+    def __init__(self, current):
+        current.state = CURRENT
+        current.activated = time.time()
+        self.current = current
+        self.previous = None
+        self.pending = None
+        self.retired = []
+        self.lock = threading.Lock()
+
+        self.reloads = metrics.counter('model_reloads_total', 'New model versions posted to the admin endpoint by result', labels=('result',))
+        self.rollbacks = metrics.counter('model_rollbacks_total', 'Rollbacks to the previous model version')
+
+    def acquire(self):
+        with self.lock:
+            version = self.current
+            version.users += 1
+            return version
+
+    def release(self, version):
+        with self.lock:
+            version.users -= 1
+        self.prune()
+
+    # register a new version which is being loaded, return False if another one is loading already
+    def begin(self, version):
+        with self.lock:
+            if self.pending is not None:
+                return False
+            self.pending = version
+            return True
+
+    # make the loaded version the current one, the current version becomes the previous one
+    def activate(self, version):
+        with self.lock:
+            if self.previous is not None:
+                self.previous.state = RETIRED
+                self.retired.append(self.previous)
+            self.current.state = PREVIOUS
+            self.previous = self.current
+            version.state = CURRENT
+            version.activated = time.time()
+            self.current = version
+            if self.pending is version:
+                self.pending = None
+        self.reloads.labels('activated').inc()
+        version.done.set()
+        self.prune()
+
+    # the version could not be loaded, the current version stays
+    def fail(self, version, error):
+        with self.lock:
+            version.state = FAILED
+            version.error = error
+            if self.pending is version:
+                self.pending = None
+        self.reloads.labels('failed').inc()
+        version.unload()
+        version.done.set()
+
+    # switch back to the previous version, return the new current version or None if there is none
+    def rollback(self):
+        with self.lock:
+            if self.previous is None:
+                return None
+            self.current, self.previous = self.previous, self.current
+            self.current.state = CURRENT
+            self.current.activated = time.time()
+            self.previous.state = PREVIOUS
+            version = self.current
+        self.rollbacks.inc()
+        return version
+
+    # unload the retired versions which are not used any more
+    def prune(self):
+        with self.lock:
+            unused = [version for version in self.retired if version.users == 0]
+            self.retired = [version for version in self.retired if version.users > 0]
+        for version in unused:
+            version.unload()
+
+    def to_dict(self):
+        with self.lock:
+            versions = [self.current, self.previous, self.pending] + self.retired
+        result = {}
+        for key, version in zip(('current', 'previous', 'pending'), versions):
+            if version is not None:
+                result[key] = version.to_dict()
+        if len(versions) > 3:
+            result['retired'] = [version.to_dict() for version in versions[3:]]
+        return result
+
+
+class Loading(object):
+    """
+    A model of the model store being loaded, the requests for it wait for done.
+    error is the exception of a failed load, which the waiting requests raise as well
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class ModelCache(object):
+    """
+    The models of the model store loaded on demand, the least recently used first out.
+    load(model_id) returns a loaded ModelVersion of the model or raises ModelNotFound, it runs once
+    at a time for a model id and the other requests for the model wait for it. When it fails, the
+    waiting requests fail with the same error instead of loading the model again.
+    When the sizes of the models exceed max_bytes the least recently used ones are dropped, a model
+    which is still scoring is unloaded when its last execution releases it. The model just loaded
+    is always kept, even if it is larger than max_bytes alone.
+    """
+    def __init__(self, max_bytes, load):
+        self.max_bytes = max_bytes
+        self.load = load
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = metrics.counter('model_cache_hits_total', 'Requests for a model which was loaded already', labels=('model',))
+        self.loads = metrics.counter('model_cache_loads_total', 'Models loaded from the model store', labels=('model',))
+        self.failures = metrics.counter('model_cache_load_failures_total', 'Models which failed to load from the model store', labels=('model',))
+        self.evictions = metrics.counter('model_cache_evictions_total', 'Models dropped from the model cache by size', labels=('model',))
+        self.load_seconds = metrics.histogram('model_cache_load_seconds', 'Time to fetch, extract and load a model', LOAD_BUCKETS, labels=('model',))
+        self.size = metrics.gauge('model_cache_bytes', 'Size of the extracted files of the models in the model cache')
+        self.count = metrics.gauge('model_cache_models', 'Models in the model cache')
+
+    # return the loaded model for a request, which gives it back by release when it is done
+    def acquire(self, model_id):
+        while True:
+            with self.lock:
+                version = self.entries.get(model_id)
+                if version is not None:
+                    self.entries.move_to_end(model_id)
+                    version.users += 1
+                    self.hits.labels(model_id).inc()
+                    return version
+                loading = self.loading.get(model_id)
+                if loading is None:
+                    loading = Loading()
+                    self.loading[model_id] = loading
+                    break
+            # another request is loading the model
+            loading.done.wait()
+            if loading.error is not None:
+                raise loading.error
+
+        started = time.perf_counter()
+        try:
+            version = self.load(model_id)
+        except Exception as e:
+            loading.error = e
+            with self.lock:
+                del self.loading[model_id]
+            loading.done.set()
+            self.failures.labels(model_id).inc()
+            raise
+        self.load_seconds.labels(model_id).observe(time.perf_counter() - started)
+        self.loads.labels(model_id).inc()
+
+        with self.lock:
+            version.state = CURRENT
+            version.activated = time.time()
+            version.users += 1
+            self.entries[model_id] = version
+            self.total_bytes += version.size
+            del self.loading[model_id]
+            evicted = self._evict(model_id)
+        loading.done.set()
+        for old in evicted:
+            old.unload()
+        return version
+
+    def release(self, version):
+        with self.lock:
+            version.users -= 1
+            unload = version.state == RETIRED and version.users == 0
+        if unload:
+            version.unload()
+
+    # drop the least recently used models beyond max_bytes, return the ones to unload now
+    def _evict(self, keep):
+        unused = []
+        for model_id in list(self.entries.keys()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if model_id == keep:
+                continue
+            version = self.entries.pop(model_id)
+            self.total_bytes -= version.size
+            version.state = RETIRED
+            self.evictions.labels(model_id).inc()
+            if version.users == 0:
+                unused.append(version)
+        self.size.set(self.total_bytes)
+        self.count.set(len(self.entries))
+        return unused
+
+    def to_dict(self):
+        with self.lock:
+            versions = list(self.entries.values())
+            loading = list(self.loading.keys())
+            total_bytes = self.total_bytes
+        return {
+            'bytes': total_bytes,
+            'max_bytes': self.max_bytes,
+            'models': [version.to_dict() for version in versions],
+            'loading': loading,
+        }
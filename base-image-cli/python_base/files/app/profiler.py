@@ -0,0 +1,83 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# On-demand profiling of score executions.
+# A profiled job runs under cProfile and tracemalloc. The raw stats are written into <prefix>.prof
+# for pstats or snakeviz, and a readable report with the functions by cumulative time and the
+# peak traced memory into <prefix>.profile.txt, next to the log of the job.
+#
+# The score script of a separate process is profiled by running it through this module:
+#   python profiler.py <prefix> <score script> <arguments>
+# or in a child of the zygote. Profiled jobs always run in their own process, never in the server
+# process, as only one cProfile can be active in a process since Python 3.12, and tracemalloc traces
+# the whole process, which the profiled job then has to itself.
+
+import os
+import sys
+import time
+import runpy
+import pstats
+import cProfile
+import tracemalloc
+
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 20
+
+STATS_SUFFIX = '.prof'
+REPORT_SUFFIX = '.profile.txt'
+
+# run fn under cProfile and tracemalloc and write the stats and the report, return what fn returns
+def profile(prefix, fn, *args):
+    # PYTHONTRACEMALLOC may have started tracing already
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        return fn(*args)
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+        write_report(prefix, profiler, seconds, peak, snapshot)
+
+
+def write_report(prefix, profiler, seconds, peak, snapshot):
+    profiler.dump_stats(prefix + STATS_SUFFIX)
+    with open(prefix + REPORT_SUFFIX, 'w') as f:
+        f.write('Wall time: %.3f seconds\n' % seconds)
+        f.write('Peak traced memory: %d bytes (%.1f MB)\n' % (peak, peak / 1048576.0))
+
+        f.write('\nFunctions by cumulative time\n')
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ])
+        f.write('\nLargest allocations still alive at the end\n')
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            f.write(str(stat) + '\n')
+
+
+# run the score script as __main__ under the profiler, the same as python <script> <arguments>
+def main():
+    prefix = sys.argv[1]
+    script = sys.argv[2]
+    sys.argv = sys.argv[2:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    profile(prefix, runpy.run_path, script, None, '__main__')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Result file downloads.
+# The scored csv repeats every input column, so it is compressed once and the compressed
+# copy <test_id>.csv.gz or <test_id>.csv.zst is kept next to it in the job workspace.
+# Downloads serve the copy which matches the Accept-Encoding of the client.
+
+import os
+import gzip
+import shutil
+import tempfile
+
+import formats
+
+# zstd is optional, install the zstandard package to serve zstd compressed results
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOCK_SIZE = 1 << 20
+
+SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+# the content encodings the server can produce, in order of preference
+def available_encodings():
+    if zstandard is not None:
+        return ['zstd', 'gzip']
+    return ['gzip']
+
+
+def encoded_file_name(file_name, encoding):
+    return file_name + SUFFIXES[encoding]
+
+
+# compress the file into <file><suffix>, the compressed file appears atomically
+# return the path of the compressed file
+def compress_file(path, encoding):
+    encoded_file = encoded_file_name(path, encoding)
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.compress-')
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dest:
+            if encoding == 'zstd':
+                with zstandard.ZstdCompressor(level=3).stream_writer(dest, closefd=False) as writer:
+                    shutil.copyfileobj(src, writer, BLOCK_SIZE)
+            else:
+                # the file name and time are left out, so the same result gives the same bytes
+                with gzip.GzipFile(filename='', mode='wb', compresslevel=6, fileobj=dest, mtime=0) as writer:
+                    shutil.copyfileobj(src, writer, BLOCK_SIZE)
+        os.replace(tmp_file, encoded_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return encoded_file
+
+
+# return the compressed copy of the file, it is created if it does not exist or is older than the file
+def get_encoded_file(path, encoding):
+    encoded_file = encoded_file_name(path, encoding)
+    try:
+        if os.path.getmtime(encoded_file) >= os.path.getmtime(path):
+            return encoded_file
+    except OSError:
+        pass
+    return compress_file(path, encoding)
+
+
+# read the rows [offset, offset + limit) of the csv file in chunks and yield them as csv or json lines
+# only the selected columns are parsed, in the order they are given
+def iter_rows(path, columns=None, offset=0, limit=None, fmt='csv', chunk_rows=10000):
+    import pandas as pd
+
+    options = {}
+    if fmt == 'csv':
+        # the values are passed through as they are written in the file
+        options = {'dtype': str, 'keep_default_na': False}
+    # the header is read once and the rows before the offset are skipped without parsing them,
+    # the parser would tokenize each skipped row
+    names = formats.read_columns(path)
+    f = open(path, 'rb')
+    header = True
+    try:
+        formats.skip_lines(f, offset + 1)
+        reader = pd.read_csv(f, header=None, names=names, usecols=columns, nrows=limit,
+                             chunksize=chunk_rows, **options)
+        for chunk in reader:
+            if columns is not None:
+                chunk = chunk[columns]
+            if fmt == 'jsonl':
+                text = chunk.to_json(orient='records', lines=True, double_precision=15)
+                if text and not text.endswith('\n'):
+                    text += '\n'
+            else:
+                text = chunk.to_csv(index=False, header=header)
+                header = False
+            yield text
+    finally:
+        f.close()
+
+    if header and fmt == 'csv':
+        # no rows in the page, return the header line only
+        yield pd.DataFrame(columns=columns or names).to_csv(index=False)
@@ -4,22 +4,94 @@
 #
 
 import os
-import zipfile
+import sys
 import time
+# the startup timeline begins before the imports
+startup_started = time.perf_counter()
+import zipfile
+import zlib
+import hashlib
+import hmac
 import json
 import logging
-from flask import Flask, jsonify, request, Response
-from flask import send_from_directory
+import traceback
+import shutil
+import subprocess
+import threading
+import urllib.request
+import urllib.error
+from flask import Flask, jsonify, request, Response, g
+from flask import send_from_directory, send_file
+from werkzeug.exceptions import RequestEntityTooLarge
 
 import warnings
 warnings.filterwarnings("ignore")
 
+import engine
+import zygote
+import batcher
+import metrics
+import jobs
+import partition
+import upload
+import results
+import formats
+import cache
+import limits
+import profiler
+import tracing
+import warmup
+import manifest
+import models
+
+startup = tracing.Timeline(startup_started)
+startup.mark('imports')
+
 app = Flask(__name__)
+# uploads are streamed into the job workspace, compressed request bodies are decompressed on the fly
+app.request_class = upload.UploadRequest
+app.wsgi_app = upload.DecompressMiddleware(app.wsgi_app, r'^(/models/[^/]+)?/executions$')
 if __name__ != '__main__':
     gunicorn_logger = logging.getLogger('gunicorn.error')
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
 
+REQUEST_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+http_requests = metrics.counter('http_requests_total', 'Requests served by the scoring server', labels=('method', 'endpoint', 'status'))
+http_request_seconds = metrics.histogram('http_request_duration_seconds', 'Time to handle a request until the response starts', REQUEST_BUCKETS, labels=('method', 'endpoint'))
+http_in_flight = metrics.gauge('http_requests_in_flight', 'Requests being handled')
+score_rows = metrics.counter('score_rows_total', 'Rows scored by batch executions and real-time requests', labels=('mode',))
+score_rows_per_second = metrics.gauge('score_rows_per_second', 'Rows per second of the last batch execution')
+
+
+# a request with a traceparent header records its spans and the spans of the job it submits
+@app.before_request
+def start_request():
+    g.request_started = time.perf_counter()
+    g.request_time = time.time()
+    g.trace = tracing.from_traceparent(request.headers.get('traceparent'))
+    http_in_flight.inc()
+
+
+# count the request by its route, so that the job ids do not end up in the labels
+@app.after_request
+def count_request(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    http_requests.labels(request.method, endpoint, response.status_code).inc()
+    if 'request_started' in g:
+        http_request_seconds.labels(request.method, endpoint).observe(time.perf_counter() - g.request_started)
+    if g.get('trace') is not None:
+        g.trace.add(request.method + ' ' + endpoint, g.request_time, time.time(), g.trace.span_id, g.trace.parent_id,
+                    {'http.status_code': response.status_code}, 'server')
+    return response
+
+
+@app.teardown_request
+def end_request(error=None):
+    if 'request_started' in g:
+        http_in_flight.inc(-1)
+
 
 def locate_zip_file(dest):
     # search for zip file
@@ -39,45 +111,6 @@ def unzip_file(zip_file, dest):
     zip_ref.close()
 
 
-# find the first file which matches the pattern
-def find_file(suffix):
-    current_dir = os.getcwd()
-    for file in os.listdir(current_dir):
-        if file.endswith(suffix):
-            filename = file
-            return os.path.join(current_dir, filename)
-
-    return None
-
-
-def find_names_by_role(filename, role):
-    var_file = find_file(filename)
-    if var_file is None:
-        return None
-    if os.path.isfile(var_file):
-        with open(var_file) as f:
-            json_object = json.load(f)
-
-        names = []
-        for row in json_object:
-            if row['role'] == role:
-                names.append(row["name"])
-        if names == []:
-            return None
-        return names
-    else:
-        app.logger.info('Didnot find any role: ' + role + ' in file: ' + filename)
-        return None
-
-
-def find_score_script(filename):
-    return find_names_by_role(filename, 'score')
-
-
-def find_models(filename):
-    return find_names_by_role(filename, 'model')
-
-
 # setup model repository directory
 model_repo = '/pybox/model'
 if "model_repository" in os.environ:
@@ -87,86 +120,573 @@ app.logger.info("Model location: " + model_repo)
 if not os.path.isdir(model_repo):
     raise RuntimeError("model repository not existed!")
 
-# locate the zip file
-model_zip_file_name = locate_zip_file(model_repo)
-if model_zip_file_name is None:
+# the multi-model mode scores the models of the model store by the model id in the path /models/<model_id>,
+# the model store is a directory of <model_id>.zip files or the URL of an artifact store which serves them
+# as <model_store>/<model_id>.zip; the model of the image is optional then
+model_store = os.environ.get('model_store', '')
+
+# the score plan written into the image by the model image CLI names the zip file,
+# images without manifest.json are searched for the zip file
+model_manifest = manifest.load(model_repo)
+if model_manifest is not None:
+    model_zip_file_name = model_manifest['zip_file']
+else:
+    model_zip_file_name = locate_zip_file(model_repo)
+if model_zip_file_name is None and not model_store:
     app.logger.info("Error: Can't find model zip file in the repository!")
     raise RuntimeError("Can't find model zip file in the repository!")
 
 subfolder = model_repo
 
-model_zip_file = os.path.join(model_repo, model_zip_file_name)
+score_plan = None
+if model_zip_file_name is None:
+    app.logger.info("The image has no model, only the models of the model store are scored")
+else:
+    model_zip_file = os.path.join(model_repo, model_zip_file_name)
+
+    # extract the zip file, unless the image build has extracted it already
+    if model_manifest is not None and manifest.is_extracted(subfolder, model_manifest):
+        app.logger.info("The model files have been extracted when the image was built")
+    else:
+        unzip_file(model_zip_file, subfolder)
+    startup.mark('extract')
+
+    # the score script, the model file and the variables are resolved once, no request searches the model directory
+    if model_manifest is not None:
+        score_plan = manifest.from_manifest(subfolder, model_manifest)
+    else:
+        score_plan = manifest.discover(subfolder, model_zip_file_name)
+    app.logger.info("Score plan from " + score_plan.source + ": score script " + score_plan.score_script
+                    + ", model file " + str(score_plan.model_file or score_plan.pickle_file))
+    startup.mark('plan')
+
+
+# load the model of the score plan into the server process when the default score script is used
+# custom score scripts like ContainerWrapper.py still run in a separate process
+def init_warm_model(model_dir, plan):
+    if score_mode != 'warm':
+        return None
+
+    try:
+        if plan.score_script != engine.DEFAULT_SCORE_SCRIPT:
+            app.logger.info("Custom score script " + plan.score_script + " will run in a separate process")
+            return None
+
+        model_file = plan.model_file or plan.pickle_file
+        if model_file is None:
+            app.logger.info("Didnot find any pickle file, the score script will run in a separate process")
+            return None
+
+        # repeated rows are answered from a memory-bounded memo of the predictions
+        prediction_memo = None
+        prediction_memo_bytes = int(os.environ.get('prediction_memo_bytes', '0'))
+        if prediction_memo_bytes > 0:
+            import memo
+            prediction_memo = memo.PredictionMemo(prediction_memo_bytes)
+            app.logger.info("Prediction memo of " + str(prediction_memo_bytes) + " bytes")
+
+        started = time.perf_counter()
+        model = engine.WarmModel(model_dir, model_file, prediction_memo,
+                                 plan.input_names(), plan.output_names())
+        app.logger.info("Loaded model %s for in-process scoring in %.3f seconds" % (model_file, time.perf_counter() - started))
+        return model
+    except Exception:
+        app.logger.error("Failed to load model for in-process scoring: " + traceback.format_exc())
+        return None
 
-# extract the zip file
-unzip_file(model_zip_file, subfolder)
+
+# score mode: 'warm' loads the model once at startup, 'subprocess' runs the score script for each execution
+score_mode = os.environ.get('score_mode', 'warm')
+app.logger.info("Score mode: " + score_mode)
+warm_model = None
+if score_plan is not None:
+    warm_model = init_warm_model(subfolder, score_plan)
+    startup.mark('model')
+if warm_model is not None:
+    # the output of in-process jobs goes to the log of each job
+    engine.install_output_capture()
+
+# large csv inputs are split into row partitions which are scored in parallel
+# 'auto' uses the available cpus, '1' turns it off
+score_partitions = os.environ.get('score_partitions', 'auto')
+partition_min_bytes = int(os.environ.get('partition_min_bytes', str(64 * 1024 * 1024)))
+
+# custom score scripts and partitions are forked from a zygote which has imported numpy, pandas and sklearn already
+score_zygote = None
+if (warm_model is None or score_partitions != '1') and os.environ.get('score_zygote', 'true') == 'true':
+    score_zygote = zygote.Zygote(preload=os.environ.get('zygote_preload'))
+    score_zygote.start()
+    app.logger.info("Started score zygote process " + str(score_zygote.pid))
+    startup.mark('zygote')
+
+# concurrent real-time requests are merged into one predict call
+score_batch_size = int(os.environ.get('score_batch_size', '64'))
+score_batch_wait_ms = float(os.environ.get('score_batch_wait_ms', '0'))
+
+
+def init_batcher(warm_model):
+    if warm_model is None or score_batch_size < 2:
+        return None
+    return batcher.MicroBatcher(warm_model.prepare_records, warm_model.predict_frames, score_batch_size, score_batch_wait_ms)
+
+
+score_batcher = init_batcher(warm_model)
+
+# every job gets its own workspace under this directory, it could be on tmpfs such as /dev/shm/jobs
+job_root = os.environ.get('job_workspace', '/pybox/jobs')
+if not os.path.isdir(job_root):
+    os.makedirs(job_root)
+app.logger.info("Job workspace: " + job_root)
+metrics.gauge('job_workspace_disk_free_bytes', 'Free space of the file system of the job workspace',
+              lambda: shutil.disk_usage(job_root).free)
+metrics.gauge('job_workspace_disk_used_bytes', 'Used space of the file system of the job workspace',
+              lambda: shutil.disk_usage(job_root).used)
+
+# maximum size of an upload after decompression, 0 means no limit
+max_upload_bytes = int(os.environ.get('max_upload_bytes', '0'))
+if max_upload_bytes > 0:
+    app.config['MAX_CONTENT_LENGTH'] = max_upload_bytes
+
+# every score process is killed with its children after score_timeout seconds, 0 means no timeout
+# and its address space is limited to score_memory_limit bytes, 0 means no limit
+# the model loaded in the server process is bounded by score_workers and max_queued_jobs only
+score_timeout = int(os.environ.get('score_timeout', '0'))
+score_memory_limit = int(os.environ.get('score_memory_limit', '0'))
+
+# score_profile=true profiles every execution, otherwise only the executions with the header X-Score-Profile: true
+score_profile = os.environ.get('score_profile', 'false').lower() == 'true'
+
+# result files are compressed once when the job is done: 'gzip', 'zstd' or 'none'
+# otherwise they are compressed at the first download which accepts the encoding
+compress_results = os.environ.get('compress_results', 'none')
+if compress_results not in ('none', 'gzip', 'zstd'):
+    raise RuntimeError("compress_results must be none, gzip or zstd")
+if compress_results not in results.available_encodings() + ['none']:
+    app.logger.info("The zstandard package is not installed, result files are compressed with gzip")
+    compress_results = 'gzip'
+# the encoding of the precompressed files is preferred for downloads
+result_encodings = results.available_encodings()
+if compress_results != 'none':
+    result_encodings = [compress_results] + [e for e in result_encodings if e != compress_results]
+
+# identical executions return the job which has scored the same input with the same model
+# the model is identified by the digest of the model zip file and the score script
+result_cache = None
+model_digest = None
+result_cache_bytes = int(os.environ.get('result_cache_bytes', str(1024 * 1024 * 1024)))
+if result_cache_bytes > 0:
+    result_cache = cache.ResultCache(result_cache_bytes, int(os.environ.get('result_cache_ttl', '3600')))
+    app.logger.info("Result cache of " + str(result_cache_bytes) + " bytes")
+    if score_plan is not None:
+        model_digest = score_plan.model_digest()
+        app.logger.info("Model digest " + model_digest)
+
+# the model of the image is the first version, new versions are posted to /admin/model
+# and extracted into their own directories under model_versions
+model_versions = os.environ.get('model_versions', '/pybox/versions')
+image_version = None
+model_registry = None
+if score_plan is not None:
+    image_version = models.ModelVersion(models.IMAGE_VERSION, subfolder, model_zip_file_name, removable=False)
+    image_version.loaded(score_plan, warm_model, score_batcher, model_digest)
+    model_registry = models.ModelRegistry(image_version)
+
+
+# extract the zip file of a new model version, resolve its score plan and load the model
+def prepare_model_version(version):
+    unzip_file(os.path.join(version.model_dir, version.zip_file), version.model_dir)
+    # the default score script is a file of the base image, not of the model zip file
+    default_script = os.path.join(version.model_dir, engine.DEFAULT_SCORE_SCRIPT)
+    if not os.path.isfile(default_script) and os.path.isfile(os.path.join(subfolder, engine.DEFAULT_SCORE_SCRIPT)):
+        shutil.copy(os.path.join(subfolder, engine.DEFAULT_SCORE_SCRIPT), default_script)
+    plan = manifest.discover(version.model_dir, version.zip_file)
+    if not os.path.isfile(os.path.join(version.model_dir, plan.score_script)):
+        raise RuntimeError("Can't find the score script " + plan.score_script + " in the model zip file")
+    app.logger.info("Score plan of " + version.name + ": score script " + plan.score_script
+                    + ", model file " + str(plan.model_file or plan.pickle_file))
+
+    version_model = init_warm_model(version.model_dir, plan)
+    if version_model is not None:
+        engine.install_output_capture()
+    version.loaded(plan, version_model, init_batcher(version_model),
+                   plan.model_digest() if result_cache is not None else None)
+    version.size = jobs.directory_size(version.model_dir)
+
+
+# copy <model_id>.zip of the model store into the zip file, raise ModelNotFound if there is none
+def fetch_store_model(model_id, zip_file):
+    if model_store.startswith('http://') or model_store.startswith('https://'):
+        url = model_store.rstrip('/') + '/' + model_id + '.zip'
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response:
+                upload.save_stream(response, zip_file)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise models.ModelNotFound(model_id)
+            raise
+    else:
+        source = os.path.join(model_store, model_id + '.zip')
+        if not os.path.isfile(source):
+            raise models.ModelNotFound(model_id)
+        shutil.copyfile(source, zip_file)
+
+
+# fetch and load a model of the model store into its own directory, for the model cache
+def load_store_model(model_id):
+    started = time.perf_counter()
+    model_dir = os.path.join(model_versions, 'models', model_id + '-' + jobs.new_job_id()[:8])
+    os.makedirs(model_dir)
+    version = models.ModelVersion(model_id, model_dir, model_id + '.zip', model_id=model_id)
+    try:
+        fetch_store_model(model_id, os.path.join(model_dir, version.zip_file))
+        prepare_model_version(version)
+    except Exception:
+        shutil.rmtree(model_dir, ignore_errors=True)
+        raise
+    version.load_seconds = time.perf_counter() - started
+    app.logger.info("Loaded model %s of %d bytes from the model store in %.3f seconds" % (model_id, version.size, version.load_seconds))
+    return version
+
+
+# the models of the model store are loaded on first use into a cache of model_cache_bytes of extracted model files
+model_cache = None
+if model_store:
+    model_cache_bytes = int(os.environ.get('model_cache_bytes', str(2 * 1024 * 1024 * 1024)))
+    model_cache = models.ModelCache(model_cache_bytes, load_store_model)
+    app.logger.info("Model store " + model_store + " with a model cache of " + str(model_cache_bytes) + " bytes")
+
+# the admin endpoints require the header Authorization: Bearer <admin_token>, they are turned off without it
+admin_token = os.environ.get('admin_token', '')
 
 print("Completed Initialization!")
 
 
-# return test_id value
-# the result file will be <test_id>.csv
-def score(filename):
+# score with the model of the version loaded in the server process
+# the output of the score script is written into the log file
+# return True if succeed
+def score_in_process(model, filename, output_file, log_file):
+    warm_model = model.warm_model
+    succeeded = False
+    with open(log_file, "w+") as f:
+        f.write("Scoring...\n")
+        f.write(" in-process " + os.path.basename(warm_model.model_file) + " -i " + filename + " -o " + output_file + "\n")
+        with engine.capture_output(f):
+            try:
+                warm_model.score_file(filename, output_file)
+                succeeded = True
+            except Exception:
+                traceback.print_exc(file=f)
+        f.write("\nCompleted!\n")
+    return succeeded
+
+
+# start the score script in a child of the zygote, or in a new python process if the zygote is not available
+# the score script runs in the model directory, stdout and stderr are appended to the log file
+# the process leads its own process group, so that it can be killed with its children
+def spawn_score_script(model_dir, score_file, score_args, log_file, profile=None):
+    with tracing.phase('spawn'):
+        process = start_score_script(model_dir, score_file, score_args, log_file, profile)
+    # the process is killed when its job is cancelled
+    job = jobs.current_job()
+    if job is not None:
+        job.attach(process)
+    return process
+
+
+def start_score_script(model_dir, score_file, score_args, log_file, profile=None):
+    if score_zygote is not None:
+        try:
+            process = score_zygote.spawn(score_file, score_args, model_dir, log_file, score_memory_limit, profile)
+            return limits.LimitedProcess(process, score_timeout)
+        except OSError:
+            app.logger.info("Score zygote is not available, starting a new python process")
+
+    command = [sys.executable, '-W', 'ignore', score_file] + score_args
+    if profile is not None:
+        # run the score script through the profiler
+        command = [sys.executable, '-W', 'ignore', os.path.abspath(profiler.__file__), profile, score_file] + score_args
+    with open(log_file, "a") as f:
+        process = subprocess.Popen(command, stdout=f, stderr=subprocess.STDOUT, cwd=model_dir, start_new_session=True,
+                                   preexec_fn=limits.memory_limiter(score_memory_limit))
+    return limits.LimitedProcess(process, score_timeout)
+
+
+# fail the job when a score process has been killed by the timeout
+def check_timeout(processes, log_file):
+    if any(process.timed_out for process in processes):
+        message = "The score script was killed after exceeding the timeout of " + str(score_timeout) + " seconds"
+        app.logger.info(message + ": " + log_file)
+        with open(log_file, "a") as f:
+            f.write("\n" + message + "\n")
+        raise jobs.JobError(message)
+
+
+# run the score script and return its exit code
+def run_score_script(model_dir, score_file, score_args, log_file, profile=None):
+    process = spawn_score_script(model_dir, score_file, score_args, log_file, profile)
+    with tracing.phase('process'):
+        exit_code = process.wait()
+    check_timeout([process], log_file)
+    return exit_code
+
+
+# score the input file with the model version into <workspace>/<test_id>.csv, .parquet or .arrow by the output format
+# the process-wide current directory is never changed, so jobs can run concurrently
+# a profiled job writes <test_id>.prof and <test_id>.profile.txt into the workspace
+# return True if the result file has been written
+def run_score(model, filename, test_id, workspace, output_format='csv', profile=False):
     app.logger.debug(filename)
 
-    # based on current timestamp
-    test_id = str(time.time())
-    output_file = test_id + '.csv'
-    log_file = test_id + '.log'
+    output_file = os.path.join(workspace, test_id + formats.EXTENSIONS[output_format])
+    log_file = os.path.join(workspace, test_id + '.log')
     app.logger.debug(output_file)
+    profile_prefix = os.path.join(workspace, test_id) if profile else None
+
+    # only csv inputs are split into partitions, a profiled job runs in one process
+    partitions = 1
+    if formats.format_of(filename) == 'csv' and not profile:
+        partitions = partition.partition_count(score_partitions, filename, partition_min_bytes)
+
+    # a profiled job runs in its own process, the profilers of concurrent jobs would share the server process
+    if model.warm_model is not None and partitions < 2 and not profile:
+        app.logger.info("Scoring in-process " + filename)
+        return score_in_process(model, filename, output_file, log_file)
+
+    score_file = model.plan.score_script
+    if score_file == engine.DEFAULT_SCORE_SCRIPT:
+        return run_score_file(model, score_file, filename, output_file, log_file, workspace, partitions, profile_prefix)
+
+    # custom score scripts read and write csv files
+    converted = []
+    if formats.format_of(filename) != 'csv':
+        csv_input = os.path.join(workspace, test_id + '.input.csv')
+        formats.convert(filename, csv_input)
+        converted.append(csv_input)
+        filename = csv_input
+    csv_output = output_file
+    if output_format != 'csv':
+        csv_output = os.path.join(workspace, test_id + '.output.csv')
+        converted.append(csv_output)
 
-    # keep current dir
-    current_dir = os.getcwd()
-    os.chdir(subfolder)
+    try:
+        succeeded = run_score_file(model, score_file, filename, csv_output, log_file, workspace, partitions, profile_prefix)
+        if succeeded and csv_output != output_file:
+            formats.convert(csv_output, output_file)
+        return succeeded
+    finally:
+        for converted_file in converted:
+            if os.path.isfile(converted_file):
+                os.remove(converted_file)
 
-    # search for score script
-    # 1) search for ContainerWrapper.py
-    if os.path.isfile("ContainerWrapper.py"):
-        score_file = "ContainerWrapper.py"
-    else:
-        # 2) search for score code defined in fileMetadata.json
-        names = find_score_script('fileMetadata.json')
-
-        if names is None:
-            # 3) find the first score script in the current then
-            score_file = '_score.py'
-            for file1 in os.listdir("."):
-                if file1.endswith("score.py") and file1 != score_file:
-                    score_file = file1
-                    break
-        else:
-            score_file = names[0]
 
-    # search for model
-    names = find_models('fileMetadata.json')
-    model_param = ''
-    if names is not None:
-        model_param = ' -m '+names[0]
+# run the score script on the input file, in partitions if there are more than one
+def run_score_file(model, score_file, filename, output_file, log_file, workspace, partitions, profile=None):
+    model_param = []
+    if model.plan.model_file is not None:
+        model_param = ['-m', model.plan.model_file]
 
-    command_str = 'python -W ignore ' + score_file + model_param + ' -i ' + filename+' -o ' + output_file 
+    if partitions > 1:
+        return run_score_partitioned(model, score_file, model_param, filename, output_file, log_file, workspace, partitions)
+
+    score_args = model_param + ['-i', filename, '-o', output_file]
+    command_str = ' '.join(['python', '-W', 'ignore', score_file] + score_args)
 
     f = open(log_file,"w+")
     f.write("Scoring...\n")
     f.write(" "+command_str+"\n")
     f.close()
 
-    command_str = command_str + ' >> '+log_file + ' 2>&1'
-
     app.logger.info(command_str)
-    os.system(command_str)
+    exit_code = run_score_script(model.model_dir, score_file, score_args, log_file, profile)
+
+    f = open(log_file,"a")
+    f.write("\nCompleted!\n")
+    f.close()
+
+    return exit_code == 0 and os.path.isfile(output_file)
+
+
+# score the row partitions of the input file in parallel and merge the outputs in input order
+def run_score_partitioned(model, score_file, model_param, filename, output_file, log_file, workspace, partitions):
+    command_str = ' '.join(['python', '-W', 'ignore', score_file] + model_param + ['-i', filename, '-o', output_file])
+
+    f = open(log_file,"w+")
+    f.write("Scoring in " + str(partitions) + " partitions...\n")
+    f.write(" "+command_str+"\n")
+    f.close()
+
+    processes = []
+
+    def spawn(partition_input, partition_output, partition_log):
+        score_args = model_param + ['-i', partition_input, '-o', partition_output]
+        process = spawn_score_script(model.model_dir, score_file, score_args, partition_log)
+        processes.append(process)
+        return process
+
+    app.logger.info(command_str + " in " + str(partitions) + " partitions")
+    with tracing.phase('process'):
+        succeeded = partition.score_partitioned(spawn, filename, output_file, log_file,
+                                                os.path.join(workspace, 'partitions'), partitions)
+    check_timeout(processes, log_file)
 
     f = open(log_file,"a")
     f.write("\nCompleted!\n")
     f.close()
 
-    os.chdir(current_dir)
+    return succeeded
 
-    return test_id
+
+# return the name of the result file of the job in the workspace, or None
+def find_result_file(workspace, test_id):
+    for ext in formats.EXTENSIONS.values():
+        if os.path.isfile(os.path.join(workspace, test_id + ext)):
+            return test_id + ext
+    return None
+
+
+def run_job(job):
+    if job.trace is not None:
+        job.trace.add('queue', job.submitted, job.started)
+    with tracing.activate(job.trace), tracing.span('score', job=job.id):
+        return score_job(job)
+
+
+def score_job(job):
+    succeeded = run_score(job.model, job.input_file, job.id, job.workspace, job.output_format, job.profile)
+    if succeeded:
+        try:
+            rows = formats.count_rows(os.path.join(job.workspace, job.id + formats.EXTENSIONS[job.output_format]))
+            score_rows.labels('batch').inc(rows)
+            score_rows_per_second.set(rows / max(time.time() - job.started, 0.001))
+        except Exception:
+            app.logger.error("Failed to count the rows of " + job.id + ": " + traceback.format_exc())
+    if succeeded and compress_results != 'none' and job.output_format == 'csv':
+        try:
+            with tracing.phase('compress'):
+                results.compress_file(os.path.join(job.workspace, job.id + '.csv'), compress_results)
+        except Exception:
+            app.logger.error("Failed to compress the result of " + job.id + ": " + traceback.format_exc())
+    if succeeded and job.cache_key is not None:
+        result_file = os.path.join(job.workspace, job.id + formats.EXTENSIONS[job.output_format])
+        result_cache.complete(job.cache_key, os.path.getsize(result_file))
+    return succeeded
+
+
+def result_exists(job):
+    return find_result_file(job.workspace, job.id) is not None
+
+
+# the workspaces of finished jobs are removed after job_ttl seconds, or oldest first when they exceed job_store_bytes
+job_store = jobs.JobStore(job_root, int(os.environ.get('job_ttl', '86400')), int(os.environ.get('job_store_bytes', '0')))
+app.logger.info("Restored " + str(job_store.rebuild(find_result_file)) + " jobs from the job workspace")
+startup.mark('jobs')
+job_store.evict()
+jobs.start_janitor(job_store, int(os.environ.get('job_janitor_interval', '60')))
+
+# executions are scored by a bounded pool of worker threads
+# beyond max_queued_jobs waiting executions the server answers 429, 0 means no limit
+score_workers = int(os.environ.get('score_workers', '2'))
+job_queue = jobs.JobQueue(run_job, job_store, score_workers, int(os.environ.get('max_queued_jobs', '100')))
+
+# real-time requests scored by a custom score script run at most score_workers processes at a time
+realtime_slots = threading.BoundedSemaphore(score_workers)
+
+
+# score the warm-up input like an execution, in <job_workspace>/warmup which is not a job workspace
+def score_warmup(input_file):
+    return run_score(image_version, input_file, 'warmup', server_warmup.workspace)
+
+
+# log the startup timeline when the server has become ready
+def log_startup():
+    startup.mark('warmup')
+    app.logger.info("Startup timeline: " + startup.summary())
+    app.logger.info("Ready %.3f seconds after the server started" % startup.seconds())
+
+
+# the server is ready after a warm-up prediction has succeeded, 'false' makes it ready at once
+# without the model of the image there is nothing to warm up, the models of the model store are loaded on first use
+warmup_enabled = os.environ.get('score_warmup', 'true').lower() == 'true'
+server_warmup = warmup.WarmUp(subfolder, score_plan.input_variables if score_plan is not None else None,
+                              os.path.join(job_root, 'warmup'), score_warmup, app.logger,
+                              warmup_enabled and score_plan is not None, log_startup)
+startup.mark('setup')
+server_warmup.start()
+metrics.gauge('server_ready', 'Whether the warm-up has succeeded and the server is ready', lambda: int(server_warmup.is_ready()))
+
+
+# extract, load and warm up a new model version in a background thread while the current version keeps scoring,
+# it becomes the current version when the warm-up prediction has succeeded
+def load_model_version(version):
+    started = time.perf_counter()
+    try:
+        prepare_model_version(version)
+    except Exception as e:
+        app.logger.error("Failed to load model version " + version.name + ": " + traceback.format_exc())
+        version.load_seconds = time.perf_counter() - started
+        model_registry.fail(version, str(e))
+        return
+
+    version.state = models.WARMING
+    workspace = os.path.join(job_root, 'warmup-' + version.name)
+    version_warmup = warmup.WarmUp(version.model_dir, version.plan.input_variables, workspace,
+                                   lambda input_file: run_score(version, input_file, 'warmup', workspace),
+                                   app.logger, warmup_enabled, name='model version ' + version.name)
+    version_warmup.run()
+    version.load_seconds = time.perf_counter() - started
+    if version_warmup.state == warmup.FAILED:
+        model_registry.fail(version, version_warmup.error)
+        return
+
+    model_registry.activate(version)
+    app.logger.info("Model version %s is current after %.3f seconds" % (version.name, version.load_seconds))
+
+
+# the admin endpoints require the header Authorization: Bearer <admin_token>
+# return the error response, or None if the request may pass
+def check_admin_token():
+    if not admin_token:
+        return forbidden("The admin endpoints are turned off, set admin_token to turn them on!")
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode('utf-8'), admin_token.encode('utf-8')):
+        return unauthorized("The admin token is missing or wrong!")
+    return None
 
 
 @app.route('/', methods=['GET'])
 def ping():
     return return_text("pong")
 
+
+@app.route('/health/live', methods=['GET'])
+def live():
+    """
+ * Liveness: the server process answers requests, even while the model is warming up
+    """
+    return jsonify({'status': 200, 'live': True})
+
+
+@app.route('/health/ready', methods=['GET'])
+def ready():
+    """
+ * Readiness: the model is loaded and the warm-up prediction has succeeded
+ * 503 with the state of the warm-up until then, or when the warm-up has failed
+    """
+    message = {
+        'status': 200,
+        'ready': server_warmup.is_ready(),
+        'warmup': server_warmup.to_dict(),
+        'startup': startup.to_dict()
+    }
+    if not message['ready']:
+        message['status'] = 503
+    resp = jsonify(message)
+    resp.status_code = message['status']
+    if not message['ready'] and server_warmup.state != warmup.FAILED:
+        resp.headers['Retry-After'] = '1'
+
+    return resp
+
 @app.route('/swagger.json', methods=['GET'])
 def swagger():
     with open('./swagger.json') as f:
@@ -183,65 +703,477 @@ def swagger():
 @app.route('/executions', methods=['POST'])
 def batch():
     """
- * Accept input data in csv file and store it to subdirectory <model repo dir>/<job definition id>
+ * Accept input data in csv file and store it to the workspace of the job <job workspace dir>/<test_id>
+   - multipart/form-data with the field 'file', or the raw csv as the request body with ?filename=
+   - the upload is streamed to the workspace in chunks, Content-Encoding gzip, deflate and zstd are decompressed on the fly
+   - Parquet and Arrow IPC files are accepted by the file extension (.parquet, .arrow) or the content type of the body
+ * the result is written in the format of the input, or in csv, parquet or arrow by ?format=
  * Try sample.csv if there's no input data file;
  * execute the python program (under the anaconda environment)
- * extract score filename from fileMetadata.json if any, otherwise assume the first python script ending with 'score.py'. Default script is _score.py
+ * score with the score script of the score plan, resolved at startup from manifest.json or the model files
  * execution
-   - cd <model repo dir>/<job definition id>
-   - python score.py -i <inputdata.csv> -o <timestamp>.csv
- * return output filename with the path if succeed
- * TODO single score, async
+   - cd <model repo dir>
+   - python score.py -i <job workspace dir>/<test_id>/<inputdata.csv> -o <job workspace dir>/<test_id>/<test_id>.csv
+ * the job is queued for a pool of worker threads, return 202 with the job id at once
+   the state of the job is returned by /jobs/<id>, the result by /query/<id> when the job is done
+ * with ?wait=true return 201 when the job is done
+ * the workspace of the job is removed job_ttl seconds after the job is done, or ?ttl=<seconds> later
+ * an identical execution of the same input returns the id of the job which has scored it already,
+   ?cache=false scores the input again
+ * with the header X-Score-Profile: true the job runs under cProfile and tracemalloc, the report is
+   returned by /query/<id>/profile
+ * return 429 with Retry-After when max_queued_jobs executions are waiting already
+    """
+    if model_registry is None:
+        return no_default_model()
+    if not job_queue.accepts():
+        return too_many_requests("Too many executions are queued, please retry later!", job_queue.retry_after())
+
+    # the job is scored by the current model version, even if a new version becomes current meanwhile
+    return submit_execution(model_registry.acquire(), model_registry.release)
+
+
+@app.route('/models/<model_id>/executions', methods=['POST'])
+def model_batch(model_id):
+    """
+ * Score the input data with the model <model_id> of the model store, the same way as /executions
+ * the model is loaded on first use into the model cache, return 404 if it is not in the model store
+    """
+    if model_cache is None:
+        return not_found(model_id)
+    if not job_queue.accepts():
+        return too_many_requests("Too many executions are queued, please retry later!", job_queue.retry_after())
+
+    model, error = acquire_store_model(model_id)
+    if error is not None:
+        return error
+    return submit_execution(model, model_cache.release)
+
+
+# upload the input data and queue the job which is scored by the model
+# the model is given back by release(model) when the job has finished, or at once when no job is queued
+def submit_execution(model, release):
+    submitted = False
+    try:
+        encoding = request.environ.get(upload.UNSUPPORTED_ENCODING)
+        if encoding is not None:
+            return unsupported_media_type("Content-Encoding " + encoding + " is not supported!")
+
+        output_format = request.args.get('format')
+        if output_format is not None and output_format not in formats.EXTENSIONS:
+            return bad_request("The format must be csv, parquet or arrow!")
+
+        ttl = request.args.get('ttl')
+        if ttl is not None:
+            if not ttl.isdigit():
+                return bad_request("The ttl must be a number of seconds!")
+            ttl = int(ttl)
+
+        test_id = jobs.new_job_id()
+        workspace = jobs.create_workspace(job_root, test_id)
+        input_digest = None
+        upload_started = time.time()
+        try:
+            if request.mimetype == 'multipart/form-data':
+                input_file = upload.save_multipart_file(request, 'file', workspace)
+            elif request.content_length or request.environ.get('wsgi.input_terminated'):
+                # raw request body, the file name is given by ?filename= or Content-Disposition
+                body_format = formats.format_of_mimetype(request.mimetype) or 'csv'
+                input_file = os.path.join(workspace, upload.get_body_filename(request, 'input' + formats.EXTENSIONS[body_format]))
+                digest = hashlib.sha256()
+                if upload.save_stream(request.stream, input_file, digest) == 0:
+                    os.remove(input_file)
+                    input_file = None
+                else:
+                    input_digest = digest.hexdigest()
+            else:
+                input_file = None
+        except RequestEntityTooLarge:
+            shutil.rmtree(workspace, ignore_errors=True)
+            return too_large("The upload exceeds the limit of " + str(max_upload_bytes) + " bytes!")
+        except (OSError, ValueError, EOFError, zlib.error):
+            app.logger.error(traceback.format_exc())
+            shutil.rmtree(workspace, ignore_errors=True)
+            return bad_request("Failed to read the uploaded data!")
+
+        if input_file is not None:
+            tracing.record_phase('upload', upload_started, g.trace)
+
+        if input_file is None:
+            input_file_name = 'sample.csv'
+            input_file = os.path.join(model.model_dir, input_file_name)
+            if not os.path.isfile(input_file):
+                shutil.rmtree(workspace, ignore_errors=True)
+                return bad_request("Can't find sample.csv in the model zip file!")
+
+        if output_format is None:
+            output_format = formats.format_of(input_file)
+
+        # a profiled execution is always scored
+        profile = score_profile or request.headers.get('X-Score-Profile', 'false').lower() in ('true', '1')
+
+        key = None
+        if result_cache is not None and request.args.get('cache', 'true').lower() != 'false' and not profile:
+            if input_digest is None:
+                input_digest = cache.digest_files([input_file])
+            key = cache.cache_key(input_digest, model.digest, output_format)
+            cached_job = result_cache.get(key, result_exists)
+            wait = request.args.get('wait', 'false').lower() == 'true'
+            if cached_job is not None and wait:
+                cached_job.wait()
+                if cached_job.state != jobs.DONE:
+                    # the identical job has failed or was cancelled, score the input again
+                    app.logger.info("Execution " + test_id + " scores again, the identical job " + cached_job.id + " is " + cached_job.state)
+                    result_cache.discard(key, cached_job)
+                    cached_job = None
+            if cached_job is not None:
+                app.logger.info("Execution " + test_id + " is answered by the identical job " + cached_job.id)
+                shutil.rmtree(workspace, ignore_errors=True)
+                job_store.touch(cached_job)
+                if wait or cached_job.state == jobs.DONE:
+                    resp = created_request(cached_job.id)
+                else:
+                    resp = accepted_request(cached_job)
+                resp.headers['X-Result-Cache'] = 'hit'
+                return resp
+
+        job = jobs.Job(test_id, input_file, workspace, output_format, ttl)
+        job.profile = profile
+        job.trace = g.trace
+        job.model = model
+        if job.trace is not None:
+            app.logger.info("Execution " + test_id + " in trace " + job.trace.trace_id)
+        if key is not None:
+            job.cache_key = key
+            result_cache.put(key, job)
+        job.add_done_callback(lambda finished: release(model))
+        if job_queue.submit(job) is None:
+            # the queue has filled up during the upload
+            if key is not None:
+                result_cache.discard(key)
+            shutil.rmtree(workspace, ignore_errors=True)
+            return too_many_requests("Too many executions are queued, please retry later!", job_queue.retry_after())
+        submitted = True
+
+        if request.args.get('wait', 'false').lower() == 'true':
+            job.wait()
+            return created_request(test_id)
+        return accepted_request(job)
+    finally:
+        if not submitted:
+            release(model)
+
+
+# acquire the model of the model store for a request, return the model and None, or None and the error response
+def acquire_store_model(model_id):
+    if not models.is_model_id(model_id):
+        return None, not_found(model_id)
+    try:
+        return model_cache.acquire(model_id), None
+    except models.ModelNotFound:
+        return None, not_found(model_id + '.zip in the model store')
+    except Exception:
+        app.logger.error("Failed to load the model " + model_id + ": " + traceback.format_exc())
+        return None, bad_request("Failed to load the model " + model_id + " from the model store!")
+
+
+# list the models in the model cache, the least recently used first
+@app.route('/models', methods=['GET'])
+def modellist():
+    if model_cache is None:
+        return not_found('model store')
+    message = model_cache.to_dict()
+    message['status'] = 200
+    return jsonify(message)
+
+
+# list the jobs in the job store in the order of submission, optionally only the jobs in ?state=
+@app.route('/jobs', methods=['GET'])
+def joblist():
+    state = request.args.get('state')
+    job_list = [job.to_dict() for job in job_store.list(state)]
+    message = {
+        'count': len(job_list),
+        'bytes': job_store.total_bytes,
+        'jobs': job_list
+    }
+    return jsonify(message)
+
+
+# return the state and timings of a score execution
+@app.route('/jobs/<test_id>', methods=['GET'])
+def jobstatus(test_id):
+    job = job_queue.get(test_id.lower())
+    if job is None:
+        return not_found(test_id)
+
+    resp = jsonify(job.to_dict())
+    resp.status_code = 200
+    return resp
+
+
+# cancel a queued or running execution
+@app.route('/jobs/<test_id>', methods=['DELETE'])
+def jobcancel(test_id):
+    """
+ * kill the score processes of the job, remove its partial output and mark it as cancelled
+ * a queued job is cancelled at once, return 200 with the state of the job when it is cancelled
+ * a model scored in the server process cannot be interrupted, return 202 while the job finishes
+   in the background, its result is dropped
+ * return 409 if the job has finished already
+    """
+    job = job_queue.get(test_id.lower())
+    if job is None:
+        return not_found(test_id)
+    if not job_queue.cancel(job):
+        return conflict("The job " + job.id + " has finished already!")
+
+    app.logger.info("Cancelling job " + job.id)
+    job.wait(10)
+    resp = jsonify(job.to_dict())
+    resp.status_code = 200 if job.is_finished() else 202
+    return resp
+
+
+# convert the json payload of real-time scoring into a list of rows
+# accept a single row, a list of rows or {"rows": [...]}
+def get_score_records(payload):
+    if isinstance(payload, dict) and isinstance(payload.get('rows'), list):
+        payload = payload['rows']
+    elif isinstance(payload, dict):
+        payload = [payload]
+    if not isinstance(payload, list) or len(payload) == 0:
+        return None
+    for row in payload:
+        if not isinstance(row, dict):
+            return None
+    return payload
+
+
+# score the rows by the custom score script of the model version through a temporary csv file
+def score_records_by_script(model, records):
+    import pandas as pd
+
+    test_id = jobs.new_job_id()
+    workspace = jobs.create_workspace(job_root, test_id)
+    try:
+        input_file = os.path.join(workspace, 'realtime.csv')
+        inputDf = pd.DataFrame.from_records(records)
+        inputDf.to_csv(input_file, index=False)
+        if not run_score(model, input_file, test_id, workspace):
+            return None
+        outputDf = pd.read_csv(os.path.join(workspace, test_id + '.csv'))
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    # only return the columns added by the score script
+    outputDf = outputDf[[c for c in outputDf.columns if c not in inputDf.columns]]
+    return outputDf.to_dict('records')
+
+
+@app.route('/score', methods=['POST'])
+def realtime():
+    """
+ * Accept one row or a small batch of rows in json and return the predictions in the response
+ * The input columns are mapped once at startup when the model is loaded in the server process,
+   otherwise the score script runs with a temporary csv file
+ * Return 400 if a row is missing an input column of the model loaded in the server process
+    """
+    if model_registry is None:
+        return no_default_model()
+    payload = request.get_json(force=True, silent=True)
+    records = get_score_records(payload)
+    if records is None:
+        return bad_request("Expected a json object or a list of json objects!")
+
+    return score_realtime(model_registry.acquire(), model_registry.release, records)
+
+
+@app.route('/models/<model_id>/score', methods=['POST'])
+def model_realtime(model_id):
     """
+ * Score the rows in json with the model <model_id> of the model store, the same way as /score
+ * the model is loaded on first use into the model cache, return 404 if it is not in the model store
+    """
+    if model_cache is None:
+        return not_found(model_id)
+    payload = request.get_json(force=True, silent=True)
+    records = get_score_records(payload)
+    if records is None:
+        return bad_request("Expected a json object or a list of json objects!")
+
+    model, error = acquire_store_model(model_id)
+    if error is not None:
+        return error
+    return score_realtime(model, model_cache.release, records)
+
+
+# score the rows with the model, which is given back by release(model)
+def score_realtime(model, release, records):
     try:
-        file = request.files['file']
-        # print(file)
-        input_file_name = file.filename
-        input_file = os.path.join(subfolder, input_file_name)
-        file.save(input_file)
-    except:
-        input_file_name = 'sample.csv'
-        input_file = os.path.join(subfolder, input_file_name)
-        if not os.path.isfile(input_file):
-            return bad_request("Can't find sample.csv in the model zip file!")
-
-    test_id = score(input_file)
-    return created_request(test_id)
-
-
-# In future we could extend this call to two calls, one for checking status and the other for retrieving csv file
+        if model.batcher is not None:
+            predictions = model.batcher.submit(records)
+        elif model.warm_model is not None:
+            predictions = model.warm_model.score_records(records)
+        elif realtime_slots.acquire(blocking=False):
+            try:
+                predictions = score_records_by_script(model, records)
+            finally:
+                realtime_slots.release()
+        else:
+            return too_many_requests("All score workers are busy, please retry later!", 1)
+    except engine.MissingColumns as e:
+        return bad_request(str(e))
+    except Exception:
+        app.logger.error(traceback.format_exc())
+        return bad_request("Failed to score the rows!")
+    finally:
+        release(model)
+
+    if predictions is None:
+        return bad_request("The score script did not produce any result!")
+    score_rows.labels('realtime').inc(len(records))
+
+    message = {
+        'status': 200,
+        'predictions': predictions
+    }
+    return jsonify(message)
+
+
 @app.route('/query/<test_id>', methods=['GET'])
 def query(test_id):
     """
-    read csv file from <test_id>.csv as an attachment
+    read csv file from <test_id>.csv in the workspace of the job as an attachment,
+    or <test_id>.parquet / <test_id>.arrow when the execution wrote the result in these formats
+    * the csv file is compressed with gzip or zstd if the client accepts it in Accept-Encoding,
+      the compressed copy is kept in the workspace for later downloads
+    * Range and If-Range requests resume an interrupted download
+    * columns=<name>,<name> returns the selected columns only, offset=<n> and limit=<n> return
+      a page of the rows, format=csv, jsonl, parquet or arrow converts the rows
     """
     test_id = test_id.lower()
-    if not test_id.endswith('.csv'):
-        output_file = test_id + '.csv'
+    name, ext = os.path.splitext(test_id)
+    if ext in formats.EXTENSIONS.values():
+        test_id = name
+
+    workspace = jobs.get_workspace(job_root, test_id)
+    output_file = None
+    if workspace is not None:
+        output_file = find_result_file(workspace, test_id)
+    if output_file is None:
+        return not_found(test_id + '.csv')
+
+    stored_format = formats.format_of(output_file)
+    fmt = request.args.get('format', stored_format).lower()
+    if fmt != stored_format or any(name in request.args for name in ('columns', 'offset', 'limit')):
+        return query_rows(os.path.join(workspace, output_file), fmt)
+
+    if stored_format != 'csv':
+        return send_from_directory(workspace, output_file, mimetype=formats.MIMETYPES[stored_format],
+                                   as_attachment=True, conditional=True)
+
+    encoding = request.accept_encodings.best_match(result_encodings)
+    if encoding is None:
+        resp = send_from_directory(workspace, output_file, as_attachment=True, conditional=True)
     else:
-        output_file = test_id
+        encoded_file = results.get_encoded_file(os.path.join(workspace, output_file), encoding)
+        resp = send_file(encoded_file, mimetype='text/csv', as_attachment=True,
+                         download_name=output_file, conditional=True)
+        resp.headers['Content-Encoding'] = encoding
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+
+# return a page of the rows of the result file with the selected columns in the format
+# the rows of csv files are streamed in chunks, so a large page is never held in memory
+def query_rows(output_path, fmt):
+    if fmt not in formats.MIMETYPES:
+        return bad_request("The format must be csv, jsonl, parquet or arrow!")
 
-    full_output_file = os.path.join(subfolder, output_file)
-    if not os.path.isfile(full_output_file):
-        return not_found(full_output_file)
+    try:
+        offset = int(request.args.get('offset', '0'))
+        limit = request.args.get('limit')
+        if limit is not None:
+            limit = int(limit)
+    except ValueError:
+        return bad_request("The offset and the limit must be integers!")
+    if offset < 0 or (limit is not None and limit < 0):
+        return bad_request("The offset and the limit must not be negative!")
+
+    columns = None
+    if 'columns' in request.args:
+        columns = []
+        for name in request.args['columns'].split(','):
+            name = name.strip()
+            if name and name not in columns:
+                columns.append(name)
+        header = formats.read_columns(output_path)
+        unknown = [name for name in columns if name not in header]
+        if unknown or not columns:
+            return bad_request("Unknown columns: " + ', '.join(unknown) + "!")
+
+    if formats.format_of(output_path) == 'csv' and fmt in ('csv', 'jsonl'):
+        body = results.iter_rows(output_path, columns, offset, limit, fmt)
+    else:
+        # parquet and arrow files are read with the selected columns only
+        df = formats.read_frame(output_path, columns)
+        df = df.iloc[offset:None if limit is None else offset + limit]
+        body = formats.to_bytes(df, fmt)
 
-    return send_from_directory(subfolder, output_file, as_attachment=True)
+    download_name = os.path.splitext(os.path.basename(output_path))[0] + ('.jsonl' if fmt == 'jsonl' else formats.EXTENSIONS[fmt])
+    return Response(body, mimetype=formats.MIMETYPES[fmt],
+                    headers={'Content-Disposition': 'attachment; filename=' + download_name})
 
 
 # return <test_id>.log
 @app.route('/query/<test_id>/log', methods=['GET'])
 def querylog(test_id):
     """
-    read log file from <test_id>.log as an attachment
+    read log file from <test_id>.log in the workspace of the job as an attachment
     """
     test_id = test_id.lower()
     output_file = test_id + '.log'
 
-    full_output_file = os.path.join(subfolder, output_file)
-    if not os.path.isfile(full_output_file):
-        return not_found(full_output_file)
+    workspace = jobs.get_workspace(job_root, test_id)
+    if workspace is None or not os.path.isfile(os.path.join(workspace, output_file)):
+        return not_found(output_file)
+
+    return send_from_directory(workspace, output_file, as_attachment=True)
+
+
+# return the profile report of a profiled execution
+@app.route('/query/<test_id>/profile', methods=['GET'])
+def queryprofile(test_id):
+    """
+    read the profile report <test_id>.profile.txt in the workspace of the job as text,
+    or the cProfile stats <test_id>.prof as an attachment with ?format=pstats
+    """
+    test_id = test_id.lower()
+    if request.args.get('format') == 'pstats':
+        profile_file = test_id + profiler.STATS_SUFFIX
+    else:
+        profile_file = test_id + profiler.REPORT_SUFFIX
+
+    workspace = jobs.get_workspace(job_root, test_id)
+    if workspace is None or not os.path.isfile(os.path.join(workspace, profile_file)):
+        return not_found(profile_file)
+
+    if profile_file.endswith(profiler.STATS_SUFFIX):
+        return send_from_directory(workspace, profile_file, as_attachment=True)
+    return send_from_directory(workspace, profile_file, mimetype='text/plain')
+
+
+# return the metrics of the scoring server in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render_prometheus(), status=200, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
-    return send_from_directory(subfolder, output_file, as_attachment=True)
+# return the metrics of the scoring server in json
+@app.route('/system/stats', methods=['GET'])
+def systemstats():
+    return jsonify(metrics.snapshot())
 
 
 # get gunicorn log
@@ -255,6 +1187,115 @@ def systemlog():
     return send_from_directory('/var/log', 'gunicorn.log', as_attachment=True)
 
 
+@app.route('/admin/model', methods=['POST'])
+def reload_model():
+    """
+ * Load a new version of the model from a model zip file, multipart/form-data with the field 'file'
+   or the zip file as the request body with ?filename=<name>.zip
+ * requires the header Authorization: Bearer <admin_token>
+ * the zip file is extracted into <model_versions>/<version>, loaded and warmed up in the background
+   while the current version keeps scoring, then it becomes the current version at once
+ * executions and real-time requests which have started before finish on the version they started with
+ * return 202 with the new version, its state is returned by GET /admin/model
+ * with ?wait=true return 201 when the new version is current, or 400 when it has failed to load
+ * return 409 while another version is loading
+    """
+    denied = check_admin_token()
+    if denied is not None:
+        return denied
+    if model_registry is None:
+        return no_default_model()
+
+    upload_dir = os.path.join(model_versions, 'upload-' + jobs.new_job_id())
+    os.makedirs(upload_dir)
+    try:
+        if request.mimetype == 'multipart/form-data':
+            zip_file = upload.save_multipart_file(request, 'file', upload_dir)
+        elif request.content_length or request.environ.get('wsgi.input_terminated'):
+            zip_file = os.path.join(upload_dir, upload.get_body_filename(request, 'model.zip'))
+            if upload.save_stream(request.stream, zip_file) == 0:
+                zip_file = None
+        else:
+            zip_file = None
+    except RequestEntityTooLarge:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return too_large("The upload exceeds the limit of " + str(max_upload_bytes) + " bytes!")
+    except (OSError, ValueError):
+        app.logger.error(traceback.format_exc())
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return bad_request("Failed to read the uploaded model zip file!")
+
+    if zip_file is None or not zip_file.endswith('.zip') or not zipfile.is_zipfile(zip_file):
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return bad_request("Expected a model zip file!")
+
+    version_name = models.new_version_name(manifest.digest_file(zip_file))
+    version_dir = os.path.join(model_versions, version_name)
+    version = models.ModelVersion(version_name, version_dir, os.path.basename(zip_file))
+    if not model_registry.begin(version):
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return conflict("Another model version is being loaded, please retry later!")
+    os.rename(upload_dir, version_dir)
+
+    app.logger.info("Loading model version " + version_name + " from " + version.zip_file)
+    threading.Thread(target=load_model_version, args=(version,), name='model-reload', daemon=True).start()
+
+    if request.args.get('wait', 'false').lower() == 'true':
+        version.done.wait()
+        if version.state == models.FAILED:
+            return bad_request("The model version " + version_name + " failed to load: " + str(version.error))
+        resp = jsonify({'status': 201, 'version': version.to_dict()})
+        resp.status_code = 201
+        return resp
+
+    resp = jsonify({'status': 202, 'version': version.to_dict()})
+    resp.status_code = 202
+    resp.headers['Location'] = '/admin/model'
+    return resp
+
+
+# return the current, the previous and the loading model version
+@app.route('/admin/model', methods=['GET'])
+def model_versions_status():
+    denied = check_admin_token()
+    if denied is not None:
+        return denied
+    if model_registry is None:
+        return no_default_model()
+
+    message = model_registry.to_dict()
+    message['status'] = 200
+    return jsonify(message)
+
+
+@app.route('/admin/model/rollback', methods=['POST'])
+def rollback_model():
+    """
+ * Switch back to the previous model version, which has been kept loaded, the current version becomes the previous one
+ * requires the header Authorization: Bearer <admin_token>
+ * return 409 if there is no previous version
+    """
+    denied = check_admin_token()
+    if denied is not None:
+        return denied
+    if model_registry is None:
+        return no_default_model()
+
+    version = model_registry.rollback()
+    if version is None:
+        return conflict("There is no previous model version!")
+    app.logger.info("Rolled back to model version " + version.name)
+
+    message = model_registry.to_dict()
+    message['status'] = 200
+    return jsonify(message)
+
+
+# the routes of the model of the image answer 404 when the image has no model
+def no_default_model():
+    return not_found("the model of the image, the models of the model store are scored by /models/<model_id>")
+
+
 def return_text(text):
     return Response(text, status=200, mimetype='text/plain')
 
@@ -270,6 +1311,87 @@ def created_request(msg=None):
     return resp
 
 
+def accepted_request(job):
+    message = {
+        'status': 202,
+        'id': job.id,
+        'state': job.state
+    }
+    resp = jsonify(message)
+    resp.status_code = 202
+    resp.headers['Location'] = '/jobs/' + job.id
+
+    return resp
+
+
+def unsupported_media_type(error=None):
+    message = {
+        'status': 415,
+        'message': 'Unsupported Media Type: ' + request.url + '--> ' + error,
+    }
+    resp = jsonify(message)
+    resp.status_code = 415
+
+    return resp
+
+
+def unauthorized(error=None):
+    message = {
+        'status': 401,
+        'message': 'Unauthorized: ' + request.url + '--> ' + error,
+    }
+    resp = jsonify(message)
+    resp.status_code = 401
+    resp.headers['WWW-Authenticate'] = 'Bearer'
+
+    return resp
+
+
+def forbidden(error=None):
+    message = {
+        'status': 403,
+        'message': 'Forbidden: ' + request.url + '--> ' + error,
+    }
+    resp = jsonify(message)
+    resp.status_code = 403
+
+    return resp
+
+
+def too_large(error=None):
+    message = {
+        'status': 413,
+        'message': 'Payload Too Large: ' + request.url + '--> ' + error,
+    }
+    resp = jsonify(message)
+    resp.status_code = 413
+
+    return resp
+
+
+def conflict(error=None):
+    message = {
+        'status': 409,
+        'message': 'Conflict: ' + request.url + '--> ' + error,
+    }
+    resp = jsonify(message)
+    resp.status_code = 409
+
+    return resp
+
+
+def too_many_requests(error=None, retry_after=1):
+    message = {
+        'status': 429,
+        'message': 'Too Many Requests: ' + request.url + '--> ' + error,
+    }
+    resp = jsonify(message)
+    resp.status_code = 429
+    resp.headers['Retry-After'] = str(retry_after)
+
+    return resp
+
+
 @app.errorhandler(400)
 def bad_request(error=None):
     message = {
@@ -4,7 +4,21 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
+# server_mode=async serves the connections on an event loop, see aserver.py
+if [ "${server_mode}" = "async" ]; then
+    exec gunicorn --bind 0.0.0.0:8080 aserver:create_app \
+        --worker-class aiohttp.GunicornWebWorker \
+        --workers 1 \
+        --log-level debug \
+        --log-file /var/log/gunicorn.log \
+        --access-logfile /var/log/gunicorn-access.log \
+    "$@"
+fi
+
+# jobs run in their own workspaces, so one worker process serves requests with threads
 exec gunicorn --bind 0.0.0.0:8080 server:app \
+    --workers 1 \
+    --threads ${server_threads:-8} \
     --log-level debug \
     --log-file /var/log/gunicorn.log \
     --access-logfile /var/log/gunicorn-access.log \
@@ -0,0 +1,161 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Timing of the scoring phases, and trace spans for the requests which carry a W3C traceparent header.
+# Every phase is observed in the score_phase_seconds histogram. When a trace is active in the
+# current thread, the phase is also recorded as a span of the trace, so that a client which sent
+# the traceparent can fetch the spans of its execution with /jobs/<id> and line them up with its own.
+
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+PHASE_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+# upload, spawn, process and compress are observed by the server,
+# load, read, predict and write by the model loaded in the server process
+phase_seconds = metrics.histogram('score_phase_seconds', 'Time spent in each phase of scoring', PHASE_BUCKETS, labels=('phase',))
+
+# version 00: trace id, parent span id and flags in lowercase hex
+TRACEPARENT_PATTERN = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_local = threading.local()
+
+
+def new_span_id():
+    return os.urandom(8).hex()
+
+
+class Trace(object):
+    """
+    The spans recorded by the server for a request and the job it has submitted.
+    parent_id is the span of the client, span_id is the span of the request in the server
+    which is the parent of the other spans.
+    """
+    def __init__(self, trace_id, parent_id):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.span_id = new_span_id()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    # kind is 'server' for the span of the request, 'internal' for the others
+    def add(self, name, start, end, span_id=None, parent_id=None, attributes=None, kind='internal'):
+        span = {
+            'name': name,
+            'kind': kind,
+            'span_id': span_id or new_span_id(),
+            'parent_id': parent_id or self.span_id,
+            'start': start,
+            'end': end,
+        }
+        if attributes:
+            span['attributes'] = attributes
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def to_list(self):
+        with self.lock:
+            return list(self.spans)
+
+
+# return the trace of the traceparent header, or None if it is missing or malformed
+def from_traceparent(value):
+    if not value:
+        return None
+    match = TRACEPARENT_PATTERN.match(value.strip().lower())
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return Trace(match.group(1), match.group(2))
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+# record the spans of the current thread into the trace
+@contextmanager
+def activate(trace):
+    previous = (getattr(_local, 'trace', None), getattr(_local, 'stack', None))
+    _local.trace = trace
+    _local.stack = []
+    try:
+        yield trace
+    finally:
+        _local.trace, _local.stack = previous
+
+
+# record the with block as a span of the active trace, the spans inside it become its children
+@contextmanager
+def span(name, **attributes):
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    span_id = new_span_id()
+    parent_id = _local.stack[-1] if _local.stack else None
+    _local.stack.append(span_id)
+    start = time.time()
+    try:
+        yield
+    finally:
+        _local.stack.pop()
+        trace.add(name, start, time.time(), span_id, parent_id, attributes)
+
+
+# time a phase of scoring
+@contextmanager
+def phase(name):
+    with phase_seconds.labels(name).timer(), span(name):
+        yield
+
+
+# record a phase of the request which started at the time.time() start and ends now
+def record_phase(name, start, trace=None):
+    end = time.time()
+    phase_seconds.labels(name).observe(end - start)
+    if trace is not None:
+        trace.add(name, start, end)
+
+
+class Timeline(object):
+    """
+    Wall-clock phases of the server startup. Each phase lasts from the end of the previous one,
+    the first one from started, a time.perf_counter() value.
+    """
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.last = self.started
+        self.phases = []
+        self.lock = threading.Lock()
+
+    # end the current phase, return its seconds
+    def mark(self, name):
+        with self.lock:
+            now = time.perf_counter()
+            seconds = now - self.last
+            self.last = now
+            self.phases.append((name, seconds))
+            return seconds
+
+    def seconds(self):
+        with self.lock:
+            return self.last - self.started
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'phases': [{'name': name, 'seconds': seconds} for name, seconds in self.phases],
+                'seconds': self.last - self.started,
+            }
+
+    def summary(self):
+        with self.lock:
+            return ', '.join('%s %.3fs' % (name, seconds) for name, seconds in self.phases)
@@ -0,0 +1,167 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Streaming upload ingestion.
+# Uploads are written straight into the job workspace in fixed-size chunks instead of
+# being buffered by Werkzeug first. Request bodies with Content-Encoding gzip, deflate
+# or zstd are decompressed on the fly.
+
+import os
+import re
+import zlib
+from flask import Request
+from werkzeug.utils import secure_filename
+from werkzeug.wsgi import get_input_stream
+
+# zstd is optional, install the zstandard package to accept zstd compressed uploads
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1 << 20
+
+UNSUPPORTED_ENCODING = 'score.unsupported_encoding'
+
+
+def is_supported_encoding(encoding):
+    if encoding in ('', 'identity', 'gzip', 'x-gzip', 'deflate'):
+        return True
+    return encoding == 'zstd' and zstandard is not None
+
+
+class DecompressingReader(object):
+    """
+    Read-only file object over a compressed request body which returns the decompressed bytes
+    """
+    def __init__(self, stream, encoding):
+        self.stream = stream
+        self.zstd = encoding == 'zstd'
+        if self.zstd:
+            # reads the compressed body from the stream itself
+            self.decompressor = zstandard.ZstdDecompressor().stream_reader(stream, read_size=CHUNK_SIZE)
+        elif encoding == 'deflate':
+            self.decompressor = zlib.decompressobj()
+        else:
+            # gzip header and trailer
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.buffer = bytearray()
+        self.tail = b''
+        self.eof = False
+
+    # decompress the next chunk of the body into the buffer
+    def _fill(self):
+        if self.zstd:
+            # at most CHUNK_SIZE decompressed bytes at a time, a small body could expand to a huge one
+            data = self.decompressor.read(CHUNK_SIZE)
+            if not data:
+                self.eof = True
+            self.buffer += data
+            return
+        if self.tail:
+            data = self.tail
+        else:
+            data = self.stream.read(CHUNK_SIZE)
+            if not data:
+                self.eof = True
+                self.buffer += self.decompressor.flush()
+                return
+        # bound the output of each step, a small body could expand to a huge one
+        self.buffer += self.decompressor.decompress(data, CHUNK_SIZE)
+        self.tail = self.decompressor.unconsumed_tail
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while not self.eof:
+                self._fill()
+            size = len(self.buffer)
+        while len(self.buffer) < size and not self.eof:
+            self._fill()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readable(self):
+        return True
+
+
+class DecompressMiddleware(object):
+    """
+    WSGI middleware which replaces a compressed request body of the upload paths, which match
+    the regular expression paths, with the decompressed stream before Werkzeug parses it,
+    so multipart bodies work as well.
+    The body length is unknown after decompression, Werkzeug enforces MAX_CONTENT_LENGTH
+    on the decompressed stream.
+    """
+    def __init__(self, wsgi_app, paths):
+        self.wsgi_app = wsgi_app
+        self.paths = re.compile(paths)
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding not in ('', 'identity') and self.paths.match(environ.get('PATH_INFO', '')):
+            if is_supported_encoding(encoding):
+                environ['wsgi.input'] = DecompressingReader(get_input_stream(environ), encoding)
+                environ['wsgi.input_terminated'] = True
+                environ.pop('CONTENT_LENGTH', None)
+            else:
+                environ[UNSUPPORTED_ENCODING] = encoding
+        return self.wsgi_app(environ, start_response)
+
+
+class UploadRequest(Request):
+    """
+    Request which streams the uploaded files of a multipart body into upload_dir
+    """
+    upload_dir = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_dir is None or not filename:
+            return Request._get_file_stream(self, total_content_length, content_type, filename, content_length)
+        return open(os.path.join(self.upload_dir, secure_filename(filename) or 'input.csv'), 'wb+')
+
+
+# return the file name of a raw request body from ?filename= or the Content-Disposition header
+def get_body_filename(req, default='input.csv'):
+    filename = req.args.get('filename')
+    if not filename:
+        match = re.search(r'filename="?([^";]+)"?', req.headers.get('Content-Disposition', ''))
+        if match:
+            filename = match.group(1)
+    if not filename:
+        return default
+    return secure_filename(filename) or default
+
+
+# copy the stream into the file in fixed-size chunks, return the number of bytes
+# the data is added to the hash object digest on the way
+def save_stream(stream, path, digest=None):
+    size = 0
+    with open(path, 'wb') as f:
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            if not data:
+                break
+            f.write(data)
+            if digest is not None:
+                digest.update(data)
+            size += len(data)
+    return size
+
+
+# stream the multipart file into upload_dir and return its path
+def save_multipart_file(req, field, upload_dir):
+    req.upload_dir = upload_dir
+    file = req.files.get(field)
+    if file is None:
+        return None
+    name = getattr(file.stream, 'name', None)
+    if isinstance(name, str) and os.path.dirname(name) == upload_dir:
+        # already written into the workspace while parsing
+        file.stream.close()
+        return name
+    path = os.path.join(upload_dir, secure_filename(file.filename or '') or 'input.csv')
+    file.save(path)
+    return path
@@ -0,0 +1,153 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Warm-up of the scoring server.
+# The server is live as soon as it answers requests, but it is ready only after the model has been
+# loaded and a warm-up prediction has succeeded, so the first real request does not pay for the
+# cold start and Kubernetes routes traffic to the pod only when it can score.
+# The warm-up input is the head of sample.csv of the model, or one synthetic row built from inputVar.json.
+
+import os
+import csv
+import shutil
+import time
+import threading
+
+SAMPLE_FILE = 'sample.csv'
+INPUT_VARS_FILE = 'inputVar.json'
+SAMPLE_ROWS = 10
+
+STARTING = 'starting'
+WARMING = 'warming'
+READY = 'ready'
+FAILED = 'failed'
+
+
+# copy the header and the first rows of sample.csv, return the number of rows
+def copy_sample(sample_file, input_file, rows=SAMPLE_ROWS):
+    count = 0
+    with open(sample_file, newline='') as src, open(input_file, 'w', newline='') as dest:
+        reader = csv.reader(src)
+        writer = csv.writer(dest)
+        header = next(reader, None)
+        if header is None:
+            return 0
+        writer.writerow(header)
+        for row in reader:
+            if count >= rows:
+                break
+            writer.writerow(row)
+            count = count + 1
+    return count
+
+
+# write one row with a neutral value for each input variable of inputVar.json, empty for strings and 0 for numbers
+def write_synthetic_row(variables, input_file):
+    variables = [v for v in variables if v.get('role', 'input') == 'input']
+    if not variables:
+        return 0
+    with open(input_file, 'w', newline='') as dest:
+        writer = csv.writer(dest)
+        writer.writerow([v['name'] for v in variables])
+        writer.writerow(['' if v.get('type') == 'string' else 0 for v in variables])
+    return 1
+
+
+# write the warm-up input into input_file, return (source, rows) or (None, 0) if there is none
+def prepare_input(model_dir, input_variables, input_file):
+    sample_file = os.path.join(model_dir, SAMPLE_FILE)
+    if os.path.isfile(sample_file):
+        rows = copy_sample(sample_file, input_file)
+        if rows > 0:
+            return SAMPLE_FILE, rows
+    if input_variables is not None:
+        rows = write_synthetic_row(input_variables, input_file)
+        if rows > 0:
+            return INPUT_VARS_FILE, rows
+    return None, 0
+
+
+class WarmUp(object):
+    """
+    Readiness of the server. input_variables are the variables of inputVar.json in the score plan.
+    score(input_file) scores the warm-up input in the workspace the same way
+    as an execution and returns True when it succeeded. The workspace is removed after a successful
+    warm-up and kept with the log after a failed one. With enabled False the server is ready without
+    a warm-up prediction. on_ready is called in the warm-up thread when the server has become ready.
+    name is what becomes ready in the log, a new model version is warmed up the same way.
+    """
+    def __init__(self, model_dir, input_variables, workspace, score, logger, enabled=True, on_ready=None,
+                 name='the server'):
+        self.model_dir = model_dir
+        self.input_variables = input_variables
+        self.workspace = workspace
+        self.score = score
+        self.logger = logger
+        self.enabled = enabled
+        self.state = STARTING
+        self.source = None
+        self.rows = 0
+        self.seconds = None
+        self.error = None
+        self.ready = threading.Event()
+        self.on_ready = on_ready
+        self.name = name
+        self.thread = None
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+    # run the warm-up in a background thread, the server stays live meanwhile
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def run(self):
+        if not self.enabled:
+            self.logger.info("Warm-up is turned off, " + self.name + " is ready")
+            self.set_ready()
+            return
+
+        self.state = WARMING
+        started = time.perf_counter()
+        try:
+            shutil.rmtree(self.workspace, ignore_errors=True)
+            os.makedirs(self.workspace)
+            input_file = os.path.join(self.workspace, 'input.csv')
+            self.source, self.rows = prepare_input(self.model_dir, self.input_variables, input_file)
+            if self.source is None:
+                raise RuntimeError("Found neither " + SAMPLE_FILE + " nor " + INPUT_VARS_FILE + " for the warm-up prediction")
+            if not self.score(input_file):
+                raise RuntimeError("The warm-up prediction failed, see the log in " + self.workspace)
+        except Exception as e:
+            self.seconds = time.perf_counter() - started
+            self.error = str(e)
+            self.state = FAILED
+            self.logger.error("Warm-up failed after %.3f seconds, %s is not ready: %s" % (self.seconds, self.name, self.error))
+            return
+
+        self.seconds = time.perf_counter() - started
+        shutil.rmtree(self.workspace, ignore_errors=True)
+        self.logger.info("Warm-up prediction of %d rows from %s took %.3f seconds, %s is ready"
+                         % (self.rows, self.source, self.seconds, self.name))
+        self.set_ready()
+
+    def set_ready(self):
+        self.state = READY
+        self.ready.set()
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def to_dict(self):
+        result = {
+            'state': self.state,
+            'source': self.source,
+            'rows': self.rows,
+            'seconds': self.seconds,
+        }
+        if self.error is not None:
+            result['error'] = self.error
+        return result
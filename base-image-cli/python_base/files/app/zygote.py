@@ -0,0 +1,288 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Pre-forked zygote interpreter for custom score scripts.
+# The zygote imports the heavy packages once when the container starts, then forks
+# a child for each job which runs the score script as __main__ with the job arguments.
+# The child writes stdout and stderr straight into the job log file.
+#
+# Protocol over the unix socket, one json document per line:
+#   request  {"script": ..., "args": [...], "cwd": ..., "log": ..., "memory_limit": <bytes, 0 for none>,
+#             "profile": <prefix of the profile files, or null>}
+#   replies  {"pid": <child pid>} when the child is started
+#            {"exit": <exit code>} when the child has finished
+#            {"error": <message>} when the request is malformed or the child could not be forked,
+#            the zygote closes the connection and keeps serving the other ones
+
+import os
+import sys
+import time
+import json
+import errno
+import select
+import signal
+import socket
+import resource
+import subprocess
+
+DEFAULT_PRELOAD = 'numpy,pandas,sklearn,sklearn.base'
+
+
+# run the score script in the forked child, never returns
+def _run_child(request):
+    code = 1
+    try:
+        os.setpgid(0, 0)
+        memory_limit = request.get('memory_limit', 0)
+        if memory_limit > 0:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        os.chdir(request['cwd'])
+        fd = os.open(request['log'], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+
+        import runpy
+        import warnings
+        warnings.simplefilter('ignore')
+
+        script = request['script']
+        sys.argv = [script] + request['args']
+        # the same as python <script>, the script directory comes first in sys.path
+        sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+        try:
+            if request.get('profile'):
+                import profiler
+                profiler.profile(request['profile'], runpy.run_path, script, None, '__main__')
+            else:
+                runpy.run_path(script, run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _send(conn, message):
+    try:
+        conn.sendall((json.dumps(message) + '\n').encode('utf-8'))
+    except OSError:
+        pass
+
+
+def _serve(socket_path, parent_pid, preload):
+    # forget the signal handlers inherited from the web server worker
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGQUIT,
+                signal.SIGUSR1, signal.SIGUSR2, signal.SIGWINCH):
+        signal.signal(sig, signal.SIG_DFL)
+
+    # wake up select when a child finishes
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener.bind(socket_path)
+    listener.listen(64)
+
+    # jobs queue up on the socket while the packages are imported
+    for name in preload:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+    pending = {}    # connection -> bytes received so far
+    children = {}   # child pid -> connection
+
+    while os.getppid() == parent_pid:
+        try:
+            readable, _, _ = select.select([listener, wakeup_r] + list(pending), [], [], 1.0)
+        except InterruptedError:
+            continue
+
+        for r in readable:
+            if r is listener:
+                conn, _ = listener.accept()
+                pending[conn] = b''
+            elif r == wakeup_r:
+                try:
+                    while os.read(wakeup_r, 512):
+                        pass
+                except OSError:
+                    pass
+            else:
+                try:
+                    data = r.recv(65536)
+                except OSError:
+                    data = b''
+                if not data:
+                    del pending[r]
+                    r.close()
+                    continue
+                pending[r] += data
+                if b'\n' not in pending[r]:
+                    continue
+                try:
+                    request = json.loads(pending.pop(r).split(b'\n', 1)[0].decode('utf-8'))
+                    if not isinstance(request, dict):
+                        raise ValueError('The request is not a json object')
+                    pid = os.fork()
+                except (ValueError, OSError) as e:
+                    _send(r, {'error': str(e)})
+                    r.close()
+                    continue
+                if pid == 0:
+                    signal.set_wakeup_fd(-1)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    listener.close()
+                    for conn in list(pending) + list(children.values()) + [r]:
+                        conn.close()
+                    _run_child(request)
+                # the child leads its own process group before its pid is reported,
+                # so that the group can be killed right away
+                try:
+                    os.setpgid(pid, pid)
+                except OSError:
+                    pass
+                children[pid] = r
+                _send(r, {'pid': pid})
+
+        # reap the finished children and report their exit codes
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            conn = children.pop(pid, None)
+            if conn is not None:
+                if os.WIFSIGNALED(status):
+                    code = -os.WTERMSIG(status)
+                else:
+                    code = os.WEXITSTATUS(status)
+                _send(conn, {'exit': code})
+                conn.close()
+
+    listener.close()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+
+class ZygoteProcess(object):
+    """
+    A score script running in a child of the zygote, similar to subprocess.Popen
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.buffer = b''
+        self.returncode = None
+        message = self._read()
+        if message is None or 'pid' not in message:
+            conn.close()
+            error = message.get('error') if message is not None else None
+            raise OSError(errno.ECONNRESET, 'zygote did not start the score script' + (': ' + error if error else ''))
+        self.pid = message['pid']
+
+    # read the next message, raise subprocess.TimeoutExpired if it does not arrive in time
+    def _read(self, timeout=None):
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while b'\n' not in self.buffer:
+            if deadline is not None:
+                readable, _, _ = select.select([self.conn], [], [], max(0.0, deadline - time.monotonic()))
+                if not readable:
+                    raise subprocess.TimeoutExpired('zygote child ' + str(self.pid), timeout)
+            data = self.conn.recv(4096)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return json.loads(line.decode('utf-8'))
+
+    def wait(self, timeout=None):
+        if self.returncode is None:
+            message = self._read(timeout)
+            self.returncode = message['exit'] if message is not None else -1
+            self.conn.close()
+        return self.returncode
+
+
+class Zygote(object):
+    def __init__(self, socket_path=None, preload=None):
+        if socket_path is None:
+            socket_path = '/tmp/score-zygote-' + str(os.getpid()) + '.sock'
+        if preload is None:
+            preload = DEFAULT_PRELOAD
+        self.socket_path = socket_path
+        self.preload = [name.strip() for name in preload.split(',') if name.strip()]
+        self.pid = None
+
+    # fork the zygote process, it imports the preloaded packages in the background
+    def start(self):
+        parent_pid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _serve(self.socket_path, parent_pid, self.preload)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        self.pid = pid
+        return pid
+
+    def is_alive(self):
+        if self.pid is None:
+            return False
+        try:
+            pid, _ = os.waitpid(self.pid, os.WNOHANG)
+        except ChildProcessError:
+            return False
+        return pid == 0
+
+    # start the score script in a forked child and return a ZygoteProcess
+    # memory_limit caps the address space of the child in bytes
+    # profile is the prefix of the profile files when the script runs under the profiler
+    def spawn(self, script, args, cwd, log_file, memory_limit=0, profile=None):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+            request = {'script': script, 'args': args, 'cwd': cwd, 'log': log_file, 'memory_limit': memory_limit,
+                       'profile': profile}
+            conn.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        except OSError:
+            conn.close()
+            raise
+        return ZygoteProcess(conn)
+
+    def stop(self):
+        if self.pid is not None:
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+                os.waitpid(self.pid, 0)
+            except (OSError, ChildProcessError):
+                pass
+            self.pid = None
@@ -14,6 +14,8 @@
 # from outputVar.json.
 
 # The score script reads the input data from input csv file and store the output data in csv file.
+# Parquet (.parquet) and Arrow IPC (.arrow, .feather) files are read and written by their file
+# extension, they keep the column types, so no type inference is needed.
 
 import argparse
 import os
@@ -84,49 +86,118 @@ def intersection(lst1, lst2):
     return lst3
 
 
-def load_data_by_input_vars(data):
-    names = load_var_names('inputVar.json')
+# select the input columns of the model from the data in the order the model expects:
+# the feature names the model was fitted with, missing ones as empty columns, otherwise the
+# input variables in the column order of the data
+def select_input_vars(data, names, pkl_model=None):
+    feature_names = getattr(pkl_model, 'feature_names_in_', None)
+    if feature_names is not None:
+        return data.reindex(columns=list(feature_names))
     if names is None:
         return data
     else:
         newcolumns = intersection(list(data.columns), names)
         return data[newcolumns]
 
-    
-def run(model_file, input_file, output_file):
-    if model_file is None:
-        print('Not found Python pickle file!')
-        sys.exit()
-        
-    if not os.path.isfile(input_file):
-        print('Not found input file', input_file)
-        sys.exit()
-        
-    inputDf = pd.read_csv(input_file).fillna(0)
 
-    output_vars = load_var_names('outputVar.json')
-    
-    in_dataf = load_data_by_input_vars(inputDf)
+def load_data_by_input_vars(data):
+    names = load_var_names('inputVar.json')
+    return select_input_vars(data, names)
+
 
+def load_model(model_file):
     model = open(model_file, 'rb')
     pkl_model = pickle.load(model)
     model.close()
+    return pkl_model
 
-    tmpDf = DataFrameImputer().fit_transform(in_dataf)
-    outputDf = pd.DataFrame(pkl_model.predict_proba(tmpDf))
 
+# name the probability columns after the output variables
+def output_columns(pkl_model, output_vars):
     if output_vars is None:
-        outputcols = map(lambda x: 'P_' + str(x), list(pkl_model.classes_))
+        return list(map(lambda x: 'P_' + str(x), list(pkl_model.classes_)))
     else:
-        outputcols = map(lambda x: output_vars[x], list(pkl_model.classes_))
-    outputDf.columns = outputcols
+        return list(map(lambda x: output_vars[x], list(pkl_model.classes_)))
+
+
+# predict the probabilities of the input variables
+def predict_data(pkl_model, in_dataf, output_vars):
+    # imputing only changes missing values, skip fitting it when there are none
+    if in_dataf.isnull().values.any():
+        in_dataf = DataFrameImputer().fit_transform(in_dataf)
+    outputDf = pd.DataFrame(pkl_model.predict_proba(in_dataf))
+    outputDf.columns = output_columns(pkl_model, output_vars)
+    return outputDf
+
+
+# score the data frame with a loaded model and return the input merged with the probabilities
+# predict has the signature of predict_data, the scoring server passes its memoized predict
+def score_data(pkl_model, inputDf, input_vars, output_vars, predict=predict_data):
+    in_dataf = select_input_vars(inputDf, input_vars, pkl_model)
+
+    outputDf = predict(pkl_model, in_dataf, output_vars)
 
     # merge with input data
-    outputDf = pd.merge(inputDf, outputDf, how='inner', left_index=True, right_index=True)
+    return pd.merge(inputDf, outputDf, how='inner', left_index=True, right_index=True)
+
+
+def file_format(file_name):
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext in ('.parquet', '.pq'):
+        return 'parquet'
+    if ext in ('.arrow', '.feather', '.ipc'):
+        return 'arrow'
+    return 'csv'
+
+
+# read the data file in csv, parquet or arrow format
+def read_data(input_file):
+    fmt = file_format(input_file)
+    if fmt == 'parquet':
+        return pd.read_parquet(input_file).reset_index(drop=True)
+    if fmt == 'arrow':
+        return pd.read_feather(input_file)
+    return pd.read_csv(input_file)
+
+
+# write the data frame in the format of the file extension
+def write_data(outputDf, output_file):
+    fmt = file_format(output_file)
+    if fmt == 'parquet':
+        outputDf.to_parquet(output_file, index=False)
+    elif fmt == 'arrow':
+        outputDf.reset_index(drop=True).to_feather(output_file)
+    else:
+        outputDf.to_csv(output_file, sep=',', index=False)
+
+
+# score input file into output file, the model has been loaded already
+def score_file(pkl_model, input_file, output_file, input_vars, output_vars, predict=predict_data):
+    inputDf = read_data(input_file).fillna(0)
+
+    outputDf = score_data(pkl_model, inputDf, input_vars, output_vars, predict)
 
     print('printing first few lines...')
     print(outputDf.head())
-    outputDf.to_csv(output_file, sep=',', index=False)
+    write_data(outputDf, output_file)
+    return outputDf
+
+
+def run(model_file, input_file, output_file):
+    if model_file is None:
+        print('Not found Python pickle file!')
+        sys.exit()
+        
+    if not os.path.isfile(input_file):
+        print('Not found input file', input_file)
+        sys.exit()
+
+    input_vars = load_var_names('inputVar.json')
+    output_vars = load_var_names('outputVar.json')
+
+    pkl_model = load_model(model_file)
+
+    outputDf = score_file(pkl_model, input_file, output_file, input_vars, output_vars)
     return outputDf.to_dict()
 
 
@@ -134,8 +205,8 @@ def main():
     # parse arguments
     parser = argparse.ArgumentParser(description='Score')
     parser.add_argument('-m', dest="modelFile", help='model filename, default will be the first pkl file found in the directory')
-    parser.add_argument('-i', dest="scoreInputCSV", required=True, help='input filename')
-    parser.add_argument('-o', dest="scoreOutputCSV", required=True, help='output csv filename')
+    parser.add_argument('-i', dest="scoreInputCSV", required=True, help='input filename, .csv, .parquet or .arrow')
+    parser.add_argument('-o', dest="scoreOutputCSV", required=True, help='output filename, .csv, .parquet or .arrow')
 
     args = parser.parse_args()
     model_file = args.modelFile
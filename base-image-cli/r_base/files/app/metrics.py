@@ -0,0 +1,221 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Minimal in-process metrics for the scoring server: counters, gauges and histograms
+# kept in a registry so that the server can expose all of them in one place,
+# as json for /system/stats and in the Prometheus text format for /metrics.
+# A metric with label names is a family of metrics, one for each combination of label values.
+
+import time
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+# metric name -> metric
+registry = OrderedDict()
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        if metric.name in registry:
+            return registry[metric.name]
+        registry[metric.name] = metric
+        return metric
+
+
+class Counter(object):
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {'type': 'counter', 'value': self.value}
+
+
+class Gauge(object):
+    """
+    function is called for the current value when the gauge is read, instead of set
+    """
+    def __init__(self, name, description, function=None):
+        self.name = name
+        self.description = description
+        self.function = function
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = None
+        return {'type': 'gauge', 'value': value}
+
+
+class Histogram(object):
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    # observe the seconds spent in the with block
+    @contextmanager
+    def timer(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def snapshot(self):
+        with self.lock:
+            # cumulative counts per upper bound, the same as prometheus buckets
+            buckets = OrderedDict()
+            total = 0
+            for bound, count in zip(self.buckets, self.counts):
+                total += count
+                buckets[str(bound)] = total
+            buckets['+Inf'] = self.count
+            return {'type': 'histogram', 'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class Family(object):
+    """
+    Metrics of the same name told apart by the values of the labels
+    """
+    def __init__(self, kind, factory, name, description, labels):
+        self.kind = kind
+        self.factory = factory
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.children = OrderedDict()
+        self.lock = threading.Lock()
+
+    # return the metric of the label values, in the order of the label names
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.label_names):
+            raise ValueError('expected the values of ' + ', '.join(self.label_names))
+        with self.lock:
+            child = self.children.get(values)
+            if child is None:
+                child = self.factory()
+                self.children[values] = child
+            return child
+
+    def snapshot(self):
+        with self.lock:
+            children = list(self.children.items())
+        result = {'type': self.kind, 'values': []}
+        for values, child in children:
+            value = child.snapshot()
+            del value['type']
+            value['labels'] = OrderedDict(zip(self.label_names, values))
+            result['values'].append(value)
+        return result
+
+
+def counter(name, description, labels=None):
+    if labels:
+        return _register(Family('counter', lambda: Counter(name, description), name, description, labels))
+    return _register(Counter(name, description))
+
+
+def gauge(name, description, function=None):
+    return _register(Gauge(name, description, function))
+
+
+def histogram(name, description, buckets, labels=None):
+    if labels:
+        return _register(Family('histogram', lambda: Histogram(name, description, buckets), name, description, labels))
+    return _register(Histogram(name, description, buckets))
+
+
+# return the current values of all metrics
+def snapshot():
+    with _registry_lock:
+        metrics = list(registry.values())
+    result = OrderedDict()
+    for metric in metrics:
+        result[metric.name] = metric.snapshot()
+        result[metric.name]['description'] = metric.description
+    return result
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(name + '="' + _escape(value) + '"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_samples(name, labels, value):
+    lines = []
+    if value['type'] == 'histogram':
+        for bound, count in value['buckets'].items():
+            bucket_labels = OrderedDict(labels)
+            bucket_labels['le'] = bound
+            lines.append(name + '_bucket' + _format_labels(bucket_labels) + ' ' + str(count))
+        lines.append(name + '_sum' + _format_labels(labels) + ' ' + _format_value(value['sum']))
+        lines.append(name + '_count' + _format_labels(labels) + ' ' + str(value['count']))
+    elif value['value'] is not None:
+        lines.append(name + _format_labels(labels) + ' ' + _format_value(value['value']))
+    return lines
+
+
+# return all metrics in the Prometheus text exposition format
+def render_prometheus():
+    lines = []
+    for name, value in snapshot().items():
+        lines.append('# HELP ' + name + ' ' + value['description'].replace('\\', '\\\\').replace('\n', '\\n'))
+        lines.append('# TYPE ' + name + ' ' + value['type'])
+        if 'values' in value:
+            for child in value['values']:
+                child['type'] = value['type']
+                lines.extend(_format_samples(name, child['labels'], child))
+        else:
+            lines.extend(_format_samples(name, OrderedDict(), value))
+    return '\n'.join(lines) + '\n'
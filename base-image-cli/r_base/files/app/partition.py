@@ -0,0 +1,183 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Partitioned parallel execution for large csv inputs.
+# The input is split into row partitions at record boundaries, each partition keeps the
+# header line, the score command runs on all partitions in parallel and the outputs are
+# merged back in input order. It works on the process level, so the same code serves
+# the Python and the R score scripts.
+
+import os
+import math
+import shutil
+
+BLOCK_SIZE = 1 << 20
+
+
+# number of cpus this container may use, including the cgroup cpu quota of the pod
+def available_cpus():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            values = f.read().split()
+            if values[0] != 'max':
+                quota = float(values[0]) / float(values[1])
+    except (OSError, ValueError, IndexError):
+        try:
+            # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                cfs_quota = float(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                cfs_period = float(f.read())
+            if cfs_quota > 0:
+                quota = cfs_quota / cfs_period
+        except (OSError, ValueError):
+            pass
+
+    if quota is not None:
+        cpus = min(cpus, max(1, int(math.ceil(quota))))
+    return cpus
+
+
+# return the number of partitions for the input file
+# setting is 'auto' for the available cpus or a number, small files are not partitioned
+def partition_count(setting, input_file, min_bytes):
+    if setting == 'auto':
+        partitions = available_cpus()
+    else:
+        partitions = int(setting)
+    if partitions < 2 or os.path.getsize(input_file) < min_bytes:
+        return 1
+    return partitions
+
+
+# find the offsets where the partitions start
+# a boundary is the first line end after the even split point that is not inside a quoted value
+def find_boundaries(input_file, body_start, partitions):
+    size = os.path.getsize(input_file)
+    step = (size - body_start) / float(partitions)
+    targets = [int(body_start + step * k) for k in range(1, partitions)]
+
+    boundaries = []
+    in_quotes = 0
+    offset = body_start
+    with open(input_file, 'rb') as f:
+        f.seek(body_start)
+        while targets:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            while targets and targets[0] < offset + len(block):
+                start = max(targets[0] - offset, 0)
+                pos = block.find(b'\n', start)
+                while pos != -1 and (in_quotes + block.count(b'"', 0, pos)) % 2 != 0:
+                    pos = block.find(b'\n', pos + 1)
+                if pos == -1:
+                    # look for the boundary in the next block
+                    targets[0] = offset + len(block)
+                    break
+                boundary = offset + pos + 1
+                if boundary < size and (not boundaries or boundary > boundaries[-1]):
+                    boundaries.append(boundary)
+                targets.pop(0)
+                while targets and targets[0] < boundary:
+                    targets.pop(0)
+            in_quotes = (in_quotes + block.count(b'"')) % 2
+            offset += len(block)
+    return boundaries
+
+
+def copy_range(src, dest, length):
+    while length > 0:
+        data = src.read(min(BLOCK_SIZE, length))
+        if not data:
+            break
+        dest.write(data)
+        length -= len(data)
+
+
+# split the csv file into partition files in the directory, each with the header line
+# return the list of partition files in input order
+def split_csv(input_file, directory, partitions):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    size = os.path.getsize(input_file)
+    with open(input_file, 'rb') as f:
+        header = f.readline()
+        body_start = f.tell()
+
+    boundaries = find_boundaries(input_file, body_start, partitions)
+    starts = [body_start] + boundaries
+    ends = boundaries + [size]
+
+    partition_files = []
+    with open(input_file, 'rb') as src:
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            partition_file = os.path.join(directory, 'part-' + str(i) + '.csv')
+            with open(partition_file, 'wb') as dest:
+                dest.write(header)
+                src.seek(start)
+                copy_range(src, dest, end - start)
+            partition_files.append(partition_file)
+    return partition_files
+
+
+# concatenate the csv outputs into one file, only the first header line is kept
+def merge_csv(output_files, output_file):
+    with open(output_file, 'wb') as dest:
+        for i, partition_file in enumerate(output_files):
+            with open(partition_file, 'rb') as src:
+                if i > 0:
+                    src.readline()
+                last = b''
+                while True:
+                    data = src.read(BLOCK_SIZE)
+                    if not data:
+                        break
+                    dest.write(data)
+                    last = data[-1:]
+                if last and last != b'\n':
+                    dest.write(b'\n')
+
+
+# run the score command on every partition of the input file in parallel and merge the outputs
+# spawn(input_file, output_file, log_file) starts the score command and returns an object with wait()
+# the logs of the partitions are appended to the log file
+# return True if all partitions succeeded
+def score_partitioned(spawn, input_file, output_file, log_file, directory, partitions):
+    input_files = split_csv(input_file, directory, partitions)
+    output_files = []
+    log_files = []
+    processes = []
+    try:
+        for partition_file in input_files:
+            partition_output = partition_file[:-len('.csv')] + '.out.csv'
+            partition_log = partition_file[:-len('.csv')] + '.log'
+            output_files.append(partition_output)
+            log_files.append(partition_log)
+            processes.append(spawn(partition_file, partition_output, partition_log))
+
+        exit_codes = [process.wait() for process in processes]
+
+        with open(log_file, 'a') as log:
+            for i, (partition_log, exit_code) in enumerate(zip(log_files, exit_codes)):
+                log.write('--- partition ' + str(i) + ' exit code ' + str(exit_code) + '\n')
+                if os.path.isfile(partition_log):
+                    with open(partition_log) as f:
+                        shutil.copyfileobj(f, log)
+
+        succeeded = all(code == 0 for code in exit_codes) and all(os.path.isfile(f) for f in output_files)
+        if succeeded:
+            merge_csv(output_files, output_file)
+        return succeeded
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -6,14 +6,24 @@
 import os
 import zipfile
 import time
+# the startup timeline begins before the imports
+startup_started = time.perf_counter()
 import json
 import logging
+import subprocess
 from flask import Flask, jsonify, request, Response
 from flask import send_from_directory
 
+import partition
+import manifest
+import tracing
+
 import warnings
 warnings.filterwarnings("ignore")
 
+startup = tracing.Timeline(startup_started)
+startup.mark('imports')
+
 app = Flask(__name__)
 if __name__ != '__main__':
     gunicorn_logger = logging.getLogger('gunicorn.error')
@@ -39,45 +49,6 @@ def unzip_file(zip_file, dest):
     zip_ref.close()
 
 
-# find the first file which matches the pattern
-def find_file(suffix):
-    current_dir = os.getcwd()
-    for file in os.listdir(current_dir):
-        if file.endswith(suffix):
-            filename = file
-            return os.path.join(current_dir, filename)
-
-    return None
-
-
-def find_names_by_role(filename, role):
-    var_file = find_file(filename)
-    if var_file is None:
-        return None
-    if os.path.isfile(var_file):
-        with open(var_file) as f:
-            json_object = json.load(f)
-
-        names = []
-        for row in json_object:
-            if row['role'] == role:
-                names.append(row["name"])
-        if names == []:
-            return None
-        return names
-    else:
-        app.logger.info('Didnot find any role: ' + role + ' in file: ' + filename)
-        return None
-
-        
-def find_score_script(filename):
-    return find_names_by_role(filename, 'score')
-
-    
-def find_models(filename):
-    return find_names_by_role(filename, 'model')
-    
-    
 # setup model repository directory
 model_repo = '/pybox/model'
 if "model_repository" in os.environ:
@@ -87,8 +58,13 @@ app.logger.info("Model location: " + model_repo)
 if not os.path.isdir(model_repo):
     raise RuntimeError("model repository not existed!")
 
-# locate the zip file
-model_zip_file_name = locate_zip_file(model_repo)
+# the score plan written into the image by the model image CLI names the zip file,
+# images without manifest.json are searched for the zip file
+model_manifest = manifest.load(model_repo)
+if model_manifest is not None:
+    model_zip_file_name = model_manifest['zip_file']
+else:
+    model_zip_file_name = locate_zip_file(model_repo)
 if model_zip_file_name is None:
     app.logger.info("Error: Can't find model zip file in the repository!")
     raise RuntimeError("Can't find model zip file in the repository!")
@@ -97,9 +73,29 @@ subfolder = model_repo
 
 model_zip_file = os.path.join(model_repo, model_zip_file_name)
 
-# extract the zip file
-unzip_file(model_zip_file, subfolder)
-
+# extract the zip file, unless the image build has extracted it already
+if model_manifest is not None and manifest.is_extracted(subfolder, model_manifest):
+    app.logger.info("The model files have been extracted when the image was built")
+else:
+    unzip_file(model_zip_file, subfolder)
+startup.mark('extract')
+
+# the score script is resolved once, no request searches the model directory
+if model_manifest is not None:
+    score_plan = manifest.from_manifest(subfolder, model_manifest)
+else:
+    score_plan = manifest.discover(subfolder, model_zip_file_name, 'r')
+app.logger.info("Score plan from " + score_plan.source + ": score script " + score_plan.score_script)
+startup.mark('plan')
+
+# large csv inputs are split into row partitions which are scored in parallel
+# 'auto' uses the available cpus, '1' turns it off
+score_partitions = os.environ.get('score_partitions', 'auto')
+partition_min_bytes = int(os.environ.get('partition_min_bytes', str(64 * 1024 * 1024)))
+
+startup.mark('setup')
+app.logger.info("Startup timeline: " + startup.summary())
+app.logger.info("Ready %.3f seconds after the server started" % startup.seconds())
 print("Completed Initialization!")
 
 
@@ -118,38 +114,39 @@ def score(filename):
     current_dir = os.getcwd()
     os.chdir(subfolder)
 
-    # search for score script
-    # 1) search for ContainerWrapper.R
-    if os.path.isfile("ContainerWrapper.R"):
-        score_file = "ContainerWrapper.R"
-    else:
-        # 2) search for score code defined in fileMetadata.json
-        names = find_score_script('fileMetadata.json')
-        if names is None:
-            # 3) find the first score script in the current then
-            score_file = '_score.R'
-            for file1 in os.listdir("."):
-                if file1.endswith("score.R") and file1 != score_file:
-                    score_file = file1
-                    break
-        else:
-            score_file = names[0]
-
+    score_file = score_plan.score_script
     if not os.path.isfile(score_file):
         app.logger.info("Please prepare a score script and define it as script code!")
         return "-1"
 
     command_str = 'Rscript ' + score_file + ' -i ' + filename + ' -o ' + output_file
 
-    f = open(log_file,"w+")
-    f.write("Scoring...\n")
-    f.write(" "+command_str+"\n")
-    f.close()
+    partitions = partition.partition_count(score_partitions, filename, partition_min_bytes)
+    if partitions > 1:
+        f = open(log_file,"w+")
+        f.write("Scoring in " + str(partitions) + " partitions...\n")
+        f.write(" "+command_str+"\n")
+        f.close()
+
+        def spawn(partition_input, partition_output, partition_log):
+            with open(partition_log, "a") as log:
+                return subprocess.Popen(['Rscript', score_file, '-i', partition_input, '-o', partition_output],
+                                        stdout=log, stderr=subprocess.STDOUT, cwd=subfolder)
+
+        app.logger.info(command_str + " in " + str(partitions) + " partitions")
+        partition.score_partitioned(spawn, filename, os.path.join(subfolder, output_file),
+                                    os.path.join(subfolder, log_file),
+                                    os.path.join(subfolder, test_id + '.partitions'), partitions)
+    else:
+        f = open(log_file,"w+")
+        f.write("Scoring...\n")
+        f.write(" "+command_str+"\n")
+        f.close()
 
-    command_str = command_str + ' >> '+log_file + ' 2>&1'
+        command_str = command_str + ' >> '+log_file + ' 2>&1'
 
-    app.logger.info(command_str)
-    os.system(command_str)
+        app.logger.info(command_str)
+        os.system(command_str)
 
     f = open(log_file,"a")
     f.write("\nCompleted!\n")
@@ -165,6 +162,18 @@ def ping():
     return return_text("pong")
 
 
+# the R score script runs in a new Rscript process for each execution,
+# so the server is ready as soon as the model zip file is extracted
+@app.route('/health/live', methods=['GET'])
+def live():
+    return jsonify({'status': 200, 'live': True})
+
+
+@app.route('/health/ready', methods=['GET'])
+def ready():
+    return jsonify({'status': 200, 'ready': True})
+
+
 @app.route('/swagger.json', methods=['GET'])
 def swagger():
     with open('./swagger.json') as f:
@@ -186,7 +195,7 @@ def batch():
  * Accept input data in csv file and store it to subdirectory <model repo dir>/<job definition id>
  * Try sample.csv if there's no input data file;
  * execute the Rscript program
- * extract score filename from fileMetadata.json if any, otherwise assume the first R script ending with 'score.py'. Default script is _score.py
+ * score with the score script of the score plan, resolved at startup from manifest.json or the model files
  * execution
    - cd <model repo dir>/<job definition id>
    - Rscript score.R <inputdata.csv> <timestamp>.csv
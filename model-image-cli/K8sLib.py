@@ -31,7 +31,8 @@ class K8sLib(object):
         if self.debug_on:
             print('Debug', *args)
 
-    def deploy_application(self, app_name, image_url, host_port, container_port):
+    # env is a dict of the environment variables of the container
+    def deploy_application(self, app_name, image_url, host_port, container_port, env=None):
         if self.provider == 'AWS':
             cluster_name = self.context.split('cluster/')[-1]
             token = CloudAWSLib.get_aws_token(cluster_name)
@@ -40,7 +41,7 @@ class K8sLib(object):
         deployment_name = app_name + "-" + K8sLib.get_random_string(6)
 
         namespace = self.get_namespace()
-        deployment_obj = K8sLib.create_deployment_object(deployment_name, container_port, image_url)
+        deployment_obj = K8sLib.create_deployment_object(deployment_name, container_port, image_url, env)
         try:
             K8sLib.create_deployment(deployment_obj, namespace)
         except Exception as e:
@@ -99,13 +100,29 @@ class K8sLib(object):
         return k8s_namespace
 
     @staticmethod
-    def create_deployment_object(deployment_name, container_port, tagged_image):
+    def create_deployment_object(deployment_name, container_port, tagged_image, env=None):
+
+        # the container is live as soon as the server answers, and gets traffic only when it is ready,
+        # which is after the model has been loaded and a warm-up prediction has succeeded
+        liveness_probe = client.V1Probe(
+            http_get=client.V1HTTPGetAction(path='/health/live', port=container_port),
+            initial_delay_seconds=30,
+            period_seconds=10,
+            failure_threshold=6)
+        readiness_probe = client.V1Probe(
+            http_get=client.V1HTTPGetAction(path='/health/ready', port=container_port),
+            initial_delay_seconds=5,
+            period_seconds=5,
+            failure_threshold=3)
 
         # Configure Pod template container
         container = client.V1Container(
             name=deployment_name,
             image=tagged_image,
-            ports=[client.V1ContainerPort(container_port=container_port)])
+            ports=[client.V1ContainerPort(container_port=container_port)],
+            env=[client.V1EnvVar(name=name, value=value) for name, value in (env or {}).items()],
+            liveness_probe=liveness_probe,
+            readiness_probe=readiness_probe)
 
         # Create and configure a spec section
         template = client.V1PodTemplateSpec(
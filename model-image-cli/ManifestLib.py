@@ -0,0 +1,119 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os
+import json
+import zipfile
+import hashlib
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+BLOCK_SIZE = 1024 * 1024
+
+EXTENSIONS = {'python': '.py', 'r': '.R'}
+
+
+class ManifestLib(object):
+    """
+    Inspect the model zip file once when the image is published and write manifest.json into the image,
+    next to the zip file. The scoring server loads it at startup as its score plan: the resolved score
+    script and model file, the input and output variables and the sha256 digests of the zip file and
+    of its files. The rules are the same as in manifest.py of the base images.
+    """
+
+    # python or r, the same choice as the template folder of publish
+    @staticmethod
+    def language_of(code_type):
+        if code_type == 'R' or code_type == 'r':
+            return 'r'
+        return 'python'
+
+    @staticmethod
+    def find_name(names, suffix):
+        for name in names:
+            if name.endswith(suffix):
+                return name
+        return None
+
+    @staticmethod
+    def names_by_role(rows, role):
+        if rows is None:
+            return None
+        names = [row['name'] for row in rows if row.get('role') == role]
+        if names == []:
+            return None
+        return names
+
+    # resolve the score script, the model file and the variables from the top level files of the model
+    @staticmethod
+    def resolve(names, read_json, language='python'):
+        names = sorted(names)
+        extension = EXTENSIONS[language]
+        default_score_script = '_score' + extension
+
+        metadata_file = ManifestLib.find_name(names, 'fileMetadata.json')
+        metadata = read_json(metadata_file) if metadata_file is not None else None
+
+        if 'ContainerWrapper' + extension in names:
+            score_script = 'ContainerWrapper' + extension
+        elif ManifestLib.names_by_role(metadata, 'score') is not None:
+            score_script = ManifestLib.names_by_role(metadata, 'score')[0]
+        else:
+            score_script = ManifestLib.find_name([n for n in names if n != default_score_script], 'score' + extension)
+            if score_script is None:
+                score_script = default_score_script
+
+        models = ManifestLib.names_by_role(metadata, 'model')
+        input_file = ManifestLib.find_name(names, 'inputVar.json')
+        output_file = ManifestLib.find_name(names, 'outputVar.json')
+        return {
+            'language': language,
+            'score_script': score_script,
+            'model_file': models[0] if models is not None else None,
+            'pickle_file': ManifestLib.find_name(names, '.pkl') if language == 'python' else None,
+            'input_variables': read_json(input_file) if input_file is not None else None,
+            'output_variables': read_json(output_file) if output_file is not None else None,
+        }
+
+    @staticmethod
+    def digest(f):
+        digest = hashlib.sha256()
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def create_manifest(zip_file, code_type):
+        with open(zip_file, 'rb') as f:
+            digests = {os.path.basename(zip_file): ManifestLib.digest(f)}
+
+        with zipfile.ZipFile(zip_file, 'r') as z:
+            files = [info.filename for info in z.infolist() if not info.is_dir()]
+            for name in files:
+                with z.open(name) as member:
+                    digests[name] = ManifestLib.digest(member)
+
+            def read_json(name):
+                return json.loads(z.read(name).decode('utf-8'))
+
+            # the server lists the top level of the extracted zip file
+            names = [name for name in files if '/' not in name]
+            plan = ManifestLib.resolve(names, read_json, ManifestLib.language_of(code_type))
+
+        return {
+            'manifest_version': MANIFEST_VERSION,
+            'zip_file': os.path.basename(zip_file),
+            'plan': plan,
+            'digests': digests,
+        }
+
+    # write manifest.json into the folder of the image build, return the manifest
+    @staticmethod
+    def write_manifest(zip_file, dest_folder, code_type):
+        manifest = ManifestLib.create_manifest(zip_file, code_type)
+        with open(os.path.join(dest_folder, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
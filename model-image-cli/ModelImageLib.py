@@ -7,6 +7,9 @@ import configparser
 import os
 import shutil
 import zipfile
+import zlib
+import gzip
+import re
 import datetime
 import time
 import docker
@@ -17,15 +20,25 @@ from CloudAWSLib import CloudAWSLib
 from CloudAzureLib import CloudAzureLib
 from CloudGCPLib import CloudGCPLib
 from K8sLib import K8sLib
+from TraceLib import TraceLib, TracedSession
+from ManifestLib import ManifestLib
 import traceback
 import json
 import fileinput
 import requests
+import urllib3
 import mmAuthorization
 
 # Constants
 CONTAINER_PORT = 8080
 HOST_PORT = 8080
+# wait at most 5 minutes for the container instance to become ready
+SERVICE_UP_CHECKS = 60
+SERVICE_UP_INTERVAL = 5
+DATA_CONTENT_TYPES = {
+    '.parquet': 'application/vnd.apache.parquet',
+    '.arrow': 'application/vnd.apache.arrow.file',
+}
 
 
 class ModelImageLib(object):
@@ -50,6 +63,12 @@ class ModelImageLib(object):
             os.mkdir(self.logs_folder)
         self.log_file_full_path = os.path.join(self.logs_folder, "cli.log")
 
+        # the calls to the container instance are traced, the spans are printed when the command is done
+        self.tracer = TraceLib()
+        self.http = TracedSession(self.tracer)
+        self.trace_export = None
+        self.admin_token = None
+
     # load configuration from file
     # if provider value is passed in, it will overwrite the setting in config.properties
     # return False if failed
@@ -71,6 +90,14 @@ class ModelImageLib(object):
             else:
                 self.verbose_on = False
 
+            self.trace_export = ModelImageLib.read_config_option(config, 'Config', 'trace.export')
+            if self.trace_export is not None and len(self.trace_export) < 1:
+                self.trace_export = None
+
+            self.admin_token = ModelImageLib.read_config_option(config, 'Config', 'admin.token')
+            if self.admin_token is not None and len(self.admin_token) < 1:
+                self.admin_token = None
+
             if p is not None:
                 self.provider = p
             else:
@@ -507,6 +534,10 @@ class ModelImageLib(object):
         # and include the dependency lines in Dockerfile
         self.handle_dependencies(dest_folder, model_file_full_path)
 
+        # resolve the score plan once, the server loads manifest.json instead of discovering it at startup
+        manifest = ManifestLib.write_manifest(model_file_full_path, dest_folder, code_type)
+        self.print_msg("Score script:", manifest['plan']['score_script'], "model file:", manifest['plan']['model_file'])
+
         # tag names
         # use the first 8 characters of model_name
         tagname = model_name[:8] + '_' + model_id
@@ -518,7 +549,9 @@ class ModelImageLib(object):
 
         print("Building image...")
         self.print_msg(local_tag)
-        myimage, _ = client.images.build(path=dest_folder, tag=local_tag, buildargs={"base_repo":self.base_repo}, nocache=True)
+        # the Dockerfile extracts the model zip file at build time
+        buildargs = {"base_repo": self.base_repo, "model_zip": os.path.basename(model_file_full_path)}
+        myimage, _ = client.images.build(path=dest_folder, tag=local_tag, buildargs=buildargs, nocache=True)
         # tag it as latest version too
         self.print_msg(local_tag_latest)
         # myimage.tag(local_tag_latest)
@@ -549,15 +582,24 @@ class ModelImageLib(object):
         # make sure it is not more than 64 characters
         tag_name = tag_name[:64]
         self.print_msg(tag_name)
-        deployment_name, service_url = self.k8s.deploy_application(tag_name, image_url, HOST_PORT, CONTAINER_PORT)
+        # the container instance accepts new model versions on its admin endpoints with the admin token
+        env = {}
+        if self.admin_token is not None:
+            env['admin_token'] = self.admin_token
+        with self.tracer.span('deploy'):
+            deployment_name, service_url = self.k8s.deploy_application(tag_name, image_url, HOST_PORT, CONTAINER_PORT, env)
         self.print_msg("==========================")
         if service_url is None:
             print("Deployment failed! Please check environment settings!")
             self.stop(deployment_name)
 
         self.log('launch', image_url, deployment_name, service_url)
-        ModelImageLib.wait_for_service_up(service_url)
-        if self.k8s.check_pod_status(deployment_name):
+        with self.tracer.span('wait_for_service_up'):
+            ready = ModelImageLib.wait_for_service_up(service_url, self.http)
+        if not ready:
+            print("Deployment failed! The container instance is not ready!")
+            self.stop(deployment_name)
+        elif self.k8s.check_pod_status(deployment_name):
             self.print_msg("Guides: > python model_image_generation.py execute ", service_url, "<input file>")
             self.print_msg("Guides: > python model_image_generation.py stop", deployment_name)
             return deployment_name, service_url
@@ -566,10 +608,14 @@ class ModelImageLib(object):
             self.stop(deployment_name)
 
     # perform scoring in container instance with the input data file
-    def execute(self, service_url, csv_file):
+    # with compress the data file is streamed as the gzip compressed request body
+    # the data file can be csv, parquet or arrow, the result is written in the same format or in format
+    def execute(self, service_url, csv_file, compress=False, format=None):
         print("Performing scoring in the container instance...")
         self.print_msg("service_url:", service_url)
         self.print_msg("csv_file:", csv_file)
+        self.print_msg("compress:", compress)
+        self.print_msg("format:", format)
         if not os.path.isfile(csv_file):
             raise RuntimeError('Error! Test data file doesn\'t exist!')
 
@@ -582,57 +628,82 @@ class ModelImageLib(object):
            # 'Content-Type': 'multipart/form-data'
         }
         file_name = os.path.basename(csv_file)
-        files = {
-            'file': (file_name, open(csv_file, 'rb'), 'application/octet-stream')
-            }
+        params = {}
+        if format is not None:
+            params['format'] = format
+        if compress:
+            headers['Content-Type'] = DATA_CONTENT_TYPES.get(os.path.splitext(file_name)[1].lower(), 'text/csv')
+            headers['Content-Encoding'] = 'gzip'
+            params['filename'] = file_name
+            response = self.http.post(execution_url, params=params,
+                                      data=self.gzip_chunks(csv_file), headers=headers)
+        else:
+            files = {
+                'file': (file_name, open(csv_file, 'rb'), 'application/octet-stream')
+                }
 
-        # r = requests.post(url, files=files, data=data, headers=headers)
-        response = requests.post(execution_url, files=files, headers=headers)
+            # r = requests.post(url, files=files, data=data, headers=headers)
+            response = self.http.post(execution_url, params=params, files=files, headers=headers)
 
         resp_json = response.json()
 
-        if response.status_code != 201:
+        # 202 means the execution has been queued in the container instance
+        if response.status_code != 201 and response.status_code != 202:
             self.print_msg(response.content)
-            raise RuntimeError('Error! Failed to perform score execution!'+resp_json)
+            raise RuntimeError('Error! Failed to perform score execution!' + str(resp_json))
 
         self.print_msg(resp_json)
         test_id = resp_json['id']
         print('The test_id from score execution:', test_id)
+        if 'state' in resp_json:
+            print('The score execution is', resp_json['state'])
         self.print_msg("==========================")
         self.print_msg("Guides: > python model_image_generation.py query", service_url, test_id)
-        dest_file = os.path.join(self.logs_folder, test_id + '_input.csv')
+        dest_file = os.path.join(self.logs_folder, test_id + '_input' + (os.path.splitext(file_name)[1] or '.csv'))
         shutil.copy(csv_file, dest_file)
         self.log('execute', service_url, dest_file, test_id)
         return test_id
 
     # Retrieve the result from container instance
-    def query(self, service_url, test_id):
+    # the result is returned in the format of the execution, or converted to format
+    def query(self, service_url, test_id, format=None):
         self.print_msg("service_url:", service_url)
         self.print_msg("test_id:", test_id)
+        self.print_msg("format:", format)
 
         if not service_url.endswith('/'):
             service_url = service_url + '/'
 
-        result_file = test_id + '.csv'
-        result_url = service_url + 'query/'+result_file
+        result_file = test_id + '.' + (format or 'csv')
+        result_url = service_url + 'query/' + test_id
+        if format is not None:
+            result_url = result_url + '?format=' + format
 
-        r = requests.get(result_url, allow_redirects=True)
-        if r.status_code == 404:
+        with self.tracer.span('wait_for_job'):
+            self.wait_for_job(service_url, test_id)
+
+        with self.tracer.span('download'):
+            download_name = self.download_file(result_url, result_file)
+        if download_name is None:
             print("The test result is not available in the container instance.")
             print("Please retrieve and inspect the execution log or system log.")
             return None
-        open(result_file, 'wb').write(r.content)
+        if os.path.splitext(download_name)[1] != os.path.splitext(result_file)[1]:
+            # the execution wrote the result in parquet or arrow
+            os.replace(result_file, test_id + os.path.splitext(download_name)[1])
+            result_file = test_id + os.path.splitext(download_name)[1]
         print("The test result has been retrieved and written into file", result_file)
 
-        print("Showing the first 5 lines")
-        print("=========================")
-        with open(result_file) as myfile:
-            max = 5
-            for line in myfile:
-                max = max-1
-                print(line.strip())
-                if max < 1:
-                    break
+        if result_file.endswith('.csv') or result_file.endswith('.jsonl'):
+            print("Showing the first 5 lines")
+            print("=========================")
+            with open(result_file) as myfile:
+                max = 5
+                for line in myfile:
+                    max = max-1
+                    print(line.strip())
+                    if max < 1:
+                        break
 
         self.print_msg("==========================")
         self.print_msg("Guides: 1) remember to stop instance after usage. You can find the deployment name by running")
@@ -645,6 +716,103 @@ class ModelImageLib(object):
         self.log('query', service_url, test_id, result_file)
         return result_file
 
+    # download the file gzip compressed, an interrupted download is resumed with a range request
+    # return the file name given by the server, or None if the file is not available
+    def download_file(self, url, dest_file, retries=5):
+        part_file = dest_file + '.part'
+        etag = None
+        encoding = None
+        download_name = os.path.basename(dest_file)
+        for attempt in range(retries + 1):
+            headers = {'Accept-Encoding': 'gzip'}
+            if etag is not None and os.path.isfile(part_file):
+                headers['Range'] = 'bytes=' + str(os.path.getsize(part_file)) + '-'
+                headers['If-Range'] = etag
+            try:
+                r = self.http.get(url, headers=headers, allow_redirects=True, stream=True)
+                if r.status_code == 404:
+                    return None
+                if r.status_code != 200 and r.status_code != 206:
+                    raise RuntimeError('Error! Failed to download ' + url + ': ' + str(r.status_code))
+                # 200 means the server sent the whole file again
+                mode = 'ab' if r.status_code == 206 else 'wb'
+                etag = r.headers.get('ETag')
+                encoding = r.headers.get('Content-Encoding')
+                match = re.search(r'filename="?([^";]+)"?', r.headers.get('Content-Disposition', ''))
+                if match:
+                    download_name = match.group(1)
+                with open(part_file, mode) as f:
+                    # keep the compressed bytes, the ranges refer to them
+                    for chunk in r.raw.stream(1024 * 1024, decode_content=False):
+                        f.write(chunk)
+                break
+            except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+                if attempt == retries:
+                    raise
+                self.print_msg('The download was interrupted, resuming...', e)
+                time.sleep(1)
+
+        if encoding == 'gzip':
+            with gzip.open(part_file, 'rb') as src, open(dest_file, 'wb') as dest:
+                shutil.copyfileobj(src, dest, 1024 * 1024)
+            os.remove(part_file)
+        else:
+            os.replace(part_file, dest_file)
+        return download_name
+
+    # wait until the score execution is done or failed
+    # return the job state, or None if the container instance doesn't report the state of executions
+    def wait_for_job(self, service_url, test_id, timeout=3600):
+        job_url = service_url + 'jobs/' + test_id
+        past = 0
+        state = None
+        while past < timeout:
+            r = self.http.get(job_url)
+            if r.status_code != 200:
+                return None
+            job = r.json()
+            state = job['state']
+            if state in ('done', 'failed', 'cancelled'):
+                # the spans which the container instance has recorded for the trace of this command,
+                # an execution answered by the result cache has the spans of the original trace
+                spans = job.pop('spans', [])
+                if job.get('trace_id') == self.tracer.trace_id:
+                    self.tracer.add_server_spans(spans)
+                self.print_msg(job)
+                return state
+            self.print_msg('The score execution is', state, '...')
+            time.sleep(1)
+            past = past + 1
+        return state
+
+    # cancel a queued or running score execution in the container instance
+    # return the job state, or None if the execution is not found
+    def cancel(self, service_url, test_id):
+        self.print_msg("service_url:", service_url)
+        self.print_msg("test_id:", test_id)
+
+        if not service_url.endswith('/'):
+            service_url = service_url + '/'
+
+        r = self.http.delete(service_url + 'jobs/' + test_id)
+        if r.status_code == 404:
+            print("The score execution", test_id, "is not found in the container instance.")
+            return None
+        if r.status_code == 409:
+            print("The score execution", test_id, "has finished already.")
+            return None
+        if r.status_code not in (200, 202):
+            raise RuntimeError('Failed to cancel the score execution: ' + r.text)
+
+        job = r.json()
+        self.print_msg(job)
+        if job['state'] == 'cancelled':
+            print("The score execution", test_id, "has been cancelled.")
+        else:
+            print("The score execution", test_id, "is being cancelled, it stops when the model in the server process has finished.")
+        self.log('cancel', service_url, test_id, job['state'])
+        return job['state']
+
     # Retrieve the execution logs from container instance
     def scorelog(self, service_url, test_id):
         self.print_msg("service_url:", service_url)
@@ -656,7 +824,7 @@ class ModelImageLib(object):
         result_file = test_id + '.log'
         result_url = service_url + 'query/'+test_id + '/log'
 
-        r = requests.get(result_url, allow_redirects=True)
+        r = self.http.get(result_url, allow_redirects=True)
         if r.status_code == 404:
             print("The execution log is not available in the container instance.")
             return None
@@ -695,7 +863,7 @@ class ModelImageLib(object):
         result_url = service_url + 'system/log'
         systemlog_file = 'gunicorn.log'
 
-        r = requests.get(result_url, allow_redirects=True)
+        r = self.http.get(result_url, allow_redirects=True)
         # just override
         open(systemlog_file, 'wb').write(r.content)
         print("The system log has been retrieved and written into file", systemlog_file)
@@ -704,6 +872,58 @@ class ModelImageLib(object):
         ModelImageLib.display_last_lines(systemlog_file, 5)
         return systemlog_file
 
+    # load a new version of the model from the model zip file into the running container instance
+    # the instance keeps scoring with the current version until the new one has been warmed up
+    # return the new version
+    def reload(self, service_url, model_file):
+        self.print_msg("service_url:", service_url)
+        self.print_msg("model_file:", model_file)
+        if self.admin_token is None:
+            raise RuntimeError('Error! Please set admin.token in config.properties and launch the instance with it!')
+        if not os.path.isfile(model_file) or not model_file.endswith('.zip'):
+            raise RuntimeError('Error! Model zip file doesn\'t exist!')
+
+        if not service_url.endswith('/'):
+            service_url = service_url + '/'
+        headers = {'Authorization': 'Bearer ' + self.admin_token}
+        with open(model_file, 'rb') as f:
+            files = {'file': (os.path.basename(model_file), f, 'application/zip')}
+            r = self.http.post(service_url + 'admin/model', params={'wait': 'true'}, files=files, headers=headers)
+        if r.status_code == 404:
+            raise RuntimeError('Error! The container instance does not support model reload, please publish and launch the model!')
+        if r.status_code != 201:
+            raise RuntimeError('Failed to reload the model: ' + r.text)
+
+        version = r.json()['version']
+        self.print_msg(version)
+        print("The model version", version['version'], "is current, it has been loaded in",
+              round(version['load_seconds'], 3), "seconds.")
+        self.print_msg("Guides: > python model_image_generation.py rollback", service_url)
+        self.log('reload', service_url, model_file, version['version'])
+        return version['version']
+
+    # switch the running container instance back to the previous model version
+    # return the current version
+    def rollback(self, service_url):
+        self.print_msg("service_url:", service_url)
+        if self.admin_token is None:
+            raise RuntimeError('Error! Please set admin.token in config.properties and launch the instance with it!')
+
+        if not service_url.endswith('/'):
+            service_url = service_url + '/'
+        headers = {'Authorization': 'Bearer ' + self.admin_token}
+        r = self.http.post(service_url + 'admin/model/rollback', headers=headers)
+        if r.status_code == 409:
+            print("There is no previous model version in the container instance.")
+            return None
+        if r.status_code != 200:
+            raise RuntimeError('Failed to roll back the model: ' + r.text)
+
+        version = r.json()['current']['version']
+        print("The model version", version, "is current.")
+        self.log('rollback', service_url, version)
+        return version
+
     # terminate the deployment
     def stop(self, deployment_name):
         """
@@ -722,14 +942,33 @@ class ModelImageLib(object):
             raise RuntimeError('Deletion failed')
 
     # Run the commands (launch, execute, query, stop) in batch
-    def score(self, image_url, csv_file):
-        deployment_name, service_url = self.launch(image_url)
+    def score(self, image_url, csv_file, compress=False, format=None):
+        with self.tracer.span('launch'):
+            launched = self.launch(image_url)
+        if launched is None:
+            raise RuntimeError('Failed to launch the container instance!')
+        deployment_name, service_url = launched
+        print("===============================")
+        with self.tracer.span('execute'):
+            test_id = self.execute(service_url, csv_file, compress, format)
         print("===============================")
-        test_id = self.execute(service_url, csv_file)
+        with self.tracer.span('query'):
+            self.query(service_url, test_id)
         print("===============================")
-        self.query(service_url, test_id)
+        with self.tracer.span('stop'):
+            self.stop(deployment_name)
+
+    # print the span breakdown of the command, and export the spans to trace.export if it is set
+    def finish_trace(self):
+        if not self.tracer.spans:
+            return
         print("===============================")
-        self.stop(deployment_name)
+        self.tracer.print_breakdown()
+        if self.trace_export is not None:
+            try:
+                print("The trace has been exported to", self.tracer.export(self.trace_export))
+            except (OSError, RuntimeError, requests.exceptions.RequestException) as e:
+                print("Failed to export the trace:", e)
 
     # set verbose mode
     def set_verbose(self, b):
@@ -775,22 +1014,50 @@ class ModelImageLib(object):
                     print(line)
                 count = count+1
 
-    # wait for service up
+    # compress the file with gzip chunk by chunk, the request is sent with chunked transfer encoding
+    @staticmethod
+    def gzip_chunks(file_name, chunk_size=1024 * 1024):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        with open(file_name, 'rb') as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                chunk = compressor.compress(data)
+                if chunk:
+                    yield chunk
+        yield compressor.flush()
+
+    # wait for service up, that is until the container instance is ready: the model has been loaded
+    # and a warm-up prediction has succeeded; an instance without /health/ready is up when / answers pong
     @staticmethod
-    def wait_for_service_up(service_url):
+    def wait_for_service_up(service_url, session=requests):
+        if not service_url.endswith('/'):
+            service_url = service_url + '/'
         num = 0
-        while num < 10:
+        while num < SERVICE_UP_CHECKS:
             num = num + 1
-            print('Checking whether the instance is up or not...')
-            # timeout is 1 second
+            print('Checking whether the instance is ready or not...')
             try:
-                r = requests.get(service_url, timeout=30)
-                if r.status_code == 200 and r.text == 'pong':
-                    print('Instance is up!')
+                r = session.get(service_url + 'health/ready', timeout=30)
+                if r.status_code == 404:
+                    r = session.get(service_url, timeout=30)
+                    if r.status_code == 200 and r.text == 'pong':
+                        print('Instance is up!')
+                        return True
+                elif r.status_code == 200:
+                    print('Instance is ready!')
                     return True
-            except:
-                print(num, '==Sleep 10 seconds...')
-                time.sleep(10)
+                elif r.status_code == 503:
+                    warmup = r.json().get('warmup', {})
+                    if warmup.get('state') == 'failed':
+                        print('Instance is not ready, the warm-up failed:', warmup.get('error'))
+                        return False
+                    print(num, '==Warm-up is', warmup.get('state'), '...')
+            except (requests.exceptions.RequestException, ValueError):
+                print(num, '==Instance is not reachable yet...')
+            time.sleep(SERVICE_UP_INTERVAL)
+        return False
 
     # retrieve model information by REST call
     @staticmethod
@@ -0,0 +1,178 @@
+#
+# Copyright © 2019, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os
+import time
+import json
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import requests
+
+CLI_SERVICE = 'model-image-cli'
+SERVER_SERVICE = 'model-container'
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+
+class TraceLib(object):
+    """
+    One trace for a CLI command. The steps of the command are recorded as spans, every HTTP call to the
+    container instance carries the W3C traceparent header of its span, and the spans which the container
+    recorded for the trace are added when they are fetched from /jobs/<id>.
+    """
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.stack = []
+
+    @staticmethod
+    def new_span_id():
+        return os.urandom(8).hex()
+
+    # record the with block as a span, yield the span so that attributes can be added
+    @contextmanager
+    def span(self, name, kind=SPAN_KIND_INTERNAL, **attributes):
+        span = {
+            'name': name,
+            'span_id': TraceLib.new_span_id(),
+            'parent_id': self.stack[-1]['span_id'] if self.stack else None,
+            'service': CLI_SERVICE,
+            'kind': kind,
+            'start': time.time(),
+            'end': None,
+            'attributes': dict(attributes),
+        }
+        self.stack.append(span)
+        try:
+            yield span
+        finally:
+            self.stack.pop()
+            span['end'] = time.time()
+            self.spans.append(span)
+
+    # the traceparent header value of the current span
+    def traceparent(self):
+        span_id = self.stack[-1]['span_id'] if self.stack else TraceLib.new_span_id()
+        return '00-' + self.trace_id + '-' + span_id + '-01'
+
+    # add the spans recorded by the container instance, spans seen before are skipped
+    def add_server_spans(self, spans):
+        known = set(span['span_id'] for span in self.spans)
+        for span in spans:
+            if span['span_id'] in known:
+                continue
+            span = dict(span)
+            span['service'] = SERVER_SERVICE
+            span['kind'] = SPAN_KIND_SERVER if span.get('kind') == 'server' else SPAN_KIND_INTERNAL
+            span.setdefault('attributes', {})
+            self.spans.append(span)
+
+    # print the spans as a tree in the order of their start with their durations
+    def print_breakdown(self):
+        if not self.spans:
+            return
+        start = min(span['start'] for span in self.spans)
+        end = max(span['end'] for span in self.spans)
+        total = max(end - start, 1e-9)
+        children = {}
+        ids = set(span['span_id'] for span in self.spans)
+        for span in sorted(self.spans, key=lambda s: s['start']):
+            parent_id = span['parent_id'] if span['parent_id'] in ids else None
+            children.setdefault(parent_id, []).append(span)
+
+        print("Trace", self.trace_id, "took %.3f seconds" % total)
+        print("%10s %10s %6s  %s" % ('start ms', 'took ms', 'share', 'span'))
+
+        def show(parent_id, depth):
+            siblings = children.get(parent_id, [])
+            i = 0
+            while i < len(siblings):
+                span = siblings[i]
+                # repeated calls such as polling are shown as one line
+                j = i + 1
+                while j < len(siblings) and siblings[j]['name'] == span['name'] and siblings[j]['span_id'] not in children:
+                    j += 1
+                took = sum(s['end'] - s['start'] for s in siblings[i:j])
+                name = span['name'] if span['service'] == CLI_SERVICE else '[server] ' + span['name']
+                if j - i > 1:
+                    name = name + ' x ' + str(j - i)
+                print("%10.1f %10.1f %5.1f%%  %s%s" % ((span['start'] - start) * 1000, took * 1000,
+                                                     100 * took / total, '  ' * depth, name))
+                show(span['span_id'], depth + 1)
+                i = j
+        show(None, 0)
+
+    # the spans in the OTLP/HTTP JSON format, one resource for the CLI and one for the container
+    def to_otlp(self):
+        resource_spans = []
+        for service in (CLI_SERVICE, SERVER_SERVICE):
+            spans = [TraceLib.otlp_span(self.trace_id, span) for span in self.spans if span['service'] == service]
+            if not spans:
+                continue
+            resource_spans.append({
+                'resource': {'attributes': [TraceLib.otlp_attribute('service.name', service)]},
+                'scopeSpans': [{'scope': {'name': 'TraceLib'}, 'spans': spans}]
+            })
+        return {'resourceSpans': resource_spans}
+
+    @staticmethod
+    def otlp_span(trace_id, span):
+        result = {
+            'traceId': trace_id,
+            'spanId': span['span_id'],
+            'name': span['name'],
+            'kind': span['kind'],
+            'startTimeUnixNano': str(int(span['start'] * 1e9)),
+            'endTimeUnixNano': str(int(span['end'] * 1e9)),
+            'attributes': [TraceLib.otlp_attribute(k, v) for k, v in span['attributes'].items()],
+        }
+        if span['parent_id']:
+            result['parentSpanId'] = span['parent_id']
+        return result
+
+    @staticmethod
+    def otlp_attribute(key, value):
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    # export the spans to an OTLP/HTTP collector, e.g. http://localhost:4318/v1/traces,
+    # or into a local json file in the same format
+    def export(self, destination):
+        payload = self.to_otlp()
+        if destination.startswith('http://') or destination.startswith('https://'):
+            r = requests.post(destination, json=payload, timeout=30)
+            if r.status_code >= 300:
+                raise RuntimeError('Failed to export the trace to ' + destination + ': ' + str(r.status_code))
+        else:
+            with open(destination, 'w') as f:
+                json.dump(payload, f, indent=2)
+        return destination
+
+
+class TracedSession(requests.Session):
+    """
+    requests session which records every call as a client span and sends its traceparent header
+    """
+    def __init__(self, tracer):
+        super(TracedSession, self).__init__()
+        self.tracer = tracer
+
+    def request(self, method, url, **kwargs):
+        path = urlparse(url).path or '/'
+        with self.tracer.span('HTTP ' + method.upper() + ' ' + path, SPAN_KIND_CLIENT,
+                              **{'http.method': method.upper(), 'http.url': url}) as span:
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers['traceparent'] = self.tracer.traceparent()
+            response = super(TracedSession, self).request(method, url, headers=headers, **kwargs)
+            span['attributes']['http.status_code'] = response.status_code
+            return response
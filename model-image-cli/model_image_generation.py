@@ -41,13 +41,21 @@ if __name__ == '__main__':
     parser_execute = subparsers.add_parser("execute")
     parser_execute.add_argument("service_url", help='The exposed service URL')
     parser_execute.add_argument("csv_file", help='The test data in csv format')
+    parser_execute.add_argument("-z", "--compress", help='send the test data gzip compressed', action="store_true")
+    parser_execute.add_argument("-f", "--format", help='the format of the test result, default is the format of the test data', choices=["csv", "parquet", "arrow"])
     parser_execute.add_argument("-v", "--verbose", help='turn on verbose', action="store_true")
 
     parser_query = subparsers.add_parser("query")
     parser_query.add_argument("service_url", help='The exposed service URL')
     parser_query.add_argument("test_id", help='The test id returned from score execution')
+    parser_query.add_argument("-f", "--format", help='convert the test result into the format', choices=["csv", "jsonl", "parquet", "arrow"])
     parser_query.add_argument("-v", "--verbose", help='turn on verbose', action="store_true")
     
+    parser_cancel = subparsers.add_parser("cancel")
+    parser_cancel.add_argument("service_url", help='The exposed service URL')
+    parser_cancel.add_argument("test_id", help='The test id returned from score execution')
+    parser_cancel.add_argument("-v", "--verbose", help='turn on verbose', action="store_true")
+
     parser_stop = subparsers.add_parser("stop")
     parser_stop.add_argument("deployment_name", help='The deployment name from score execution')
     parser_stop.add_argument("-v", "--verbose", help='turn on verbose', action="store_true")
@@ -55,6 +63,8 @@ if __name__ == '__main__':
     parser_score = subparsers.add_parser("score")
     parser_score.add_argument("image_url", help='Docker image URL')
     parser_score.add_argument("csv_file", help='The test data in csv format')
+    parser_score.add_argument("-z", "--compress", help='send the test data gzip compressed', action="store_true")
+    parser_score.add_argument("-f", "--format", help='the format of the test result, default is the format of the test data', choices=["csv", "parquet", "arrow"])
     parser_score.add_argument("-v", "--verbose", help='turn on verbose', action="store_true")
     
     parser_log = subparsers.add_parser("scorelog")
@@ -62,6 +72,15 @@ if __name__ == '__main__':
     parser_log.add_argument("test_id", help='The test id returned from score execution')
     parser_log.add_argument("-v", "--verbose", help='turn on verbose', action="store_true")
     
+    parser_reload = subparsers.add_parser("reload")
+    parser_reload.add_argument("service_url", help='The exposed service URL')
+    parser_reload.add_argument("model_file", help='The model zip file of the new model version')
+    parser_reload.add_argument("-v", "--verbose", help='turn on verbose', action="store_true")
+
+    parser_rollback = subparsers.add_parser("rollback")
+    parser_rollback.add_argument("service_url", help='The exposed service URL')
+    parser_rollback.add_argument("-v", "--verbose", help='turn on verbose', action="store_true")
+
     parser_syslog = subparsers.add_parser("systemlog")
     parser_syslog.add_argument("service_url", help='The exposed service URL')
     parser_syslog.add_argument("-v", "--verbose", help='turn on verbose', action="store_true")
@@ -87,5 +106,6 @@ if __name__ == '__main__':
         action = kwargs.pop('action')
         method_to_call = getattr(image_lib, action)
         method_to_call(**kwargs)
+        image_lib.finish_trace()
     except RuntimeError as err:
         print("Runtime Error: ", err)